@@ -0,0 +1,297 @@
+"""
+Benchmarks the stages of the processing pipeline of process.py on synthetic Alchemist exports,
+so that changes to parsing, resampling and aggregation can be measured against a stored baseline.
+
+Run `python benchmark.py --help` for the available options.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import process
+
+
+def syntheticSweep(seeds, thresholds, policies):
+    """
+    Returns the coordinates of a synthetic sweep shaped like the dynamic allocation experiment.
+
+    Parameters
+    ----------
+    seeds, thresholds, policies : int
+        number of values of each variable
+
+    Returns
+    -------
+    list of dict
+        The coordinates of every experiment of the sweep
+    """
+    policyNames = ['smartphone', 'hybrid', 'wearable'] + [f'policy{idx}' for idx in range(3, policies)]
+    return [
+        {'Seed': float(seed), 'Thresholds': f'[{10.0 * threshold}, 100.0]', 'SwapPolicy': policy}
+        for seed, threshold, policy in itertools.product(range(seeds), range(thresholds), policyNames[:policies])
+    ]
+
+
+def writeSyntheticCsv(path, coordinates, columns, rows, rng):
+    """
+    Writes a file in the format of the Alchemist CSV exporter, with a 60 seconds sampling interval
+    and a few NaN values in the first rows, as produced by the simulations.
+
+    Parameters
+    ----------
+    path : str
+        path of the file to create
+    coordinates : dict
+        the variables of the experiment, written in the header
+    columns : int
+        number of columns, including the time
+    rows : int
+        number of data rows
+    rng : np.random.Generator
+        source of the values
+    """
+    times = np.arange(rows) * 60.0 + 0.0011337332612453288
+    times[0] = 0.0
+    values = rng.random((rows, columns - 1)) * 100
+    values[:2, ::2] = np.nan
+    names = ['time'] + [f'Variable{idx}[mean]' for idx in range(columns - 1)]
+    process.writeCsv(path, coordinates, names, np.column_stack([times, values]))
+
+
+def generateData(directory, sweep, rows, columns, experiment='synthetic', seed=0):
+    """
+    Writes one synthetic file per experiment of the sweep, named as the Alchemist exporter does.
+
+    Returns
+    -------
+    list of str
+        The paths of the files, sorted
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for coordinates in sweep:
+        name = '_'.join([experiment] + [f'{k}-{v}' for k, v in coordinates.items()])
+        path = f'{directory}/{name}.csv'
+        writeSyntheticCsv(path, coordinates, columns, rows, rng)
+        paths.append(path)
+    return sorted(paths)
+
+
+def measure(function, repeats):
+    """
+    Runs function repeats times, then once more tracing the allocations.
+
+    Returns
+    -------
+    dict
+        The best wall time in seconds and the peak of memory allocated by Python and NumPy, in bytes.
+        Allocations of worker processes are not traced
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': best, 'peakMemory': peak}
+
+
+def pipelineStages(paths, timeline, workers, scratch, selected):
+    """
+    Prepares the stages of the pipeline as argumentless functions, in execution order.
+    The outputs of the earlier stages that the selected ones read are computed here, outside of the measurements.
+    """
+    columns = process.extractVariableNames(paths[0])
+    timeColumn = columns.index('time')
+    inputs = {}
+
+    def header():
+        process._parseHeader.cache_clear()
+        for path in paths:
+            process.readHeader(path)
+
+    def parse():
+        return [process.openCsv(path) for path in paths]
+
+    def resample():
+        return [process.convert(timeColumn, timeline, matrix) for matrix in inputs['parse']]
+
+    def ingest():
+        return list(process.ingestFiles(paths, columns, timeColumn, timeline, workers=workers))
+
+    def builder(seedVars):
+        def build():
+            resampled = inputs['resample']
+            coordinates = [process.extractCoordinates(path) for path in paths]
+            dimensions = {}
+            for coordinate in coordinates:
+                dimensions = process.mergeDicts(dimensions, coordinate)
+            dimensions = {k: sorted(v) for k, v in dimensions.items()}
+            datasetBuilder = process.DatasetBuilder(dimensions, columns, timeline, 'time', seedVars)
+            for coordinate, matrix in zip(coordinates, resampled):
+                datasetBuilder.add(coordinate, matrix)
+            return datasetBuilder.build()
+        return build
+
+    def aggregate():
+        means, _ = inputs['build']
+        return (
+            means.max(dim='time').to_dataframe(),
+            means.sum(dim='time').to_dataframe(),
+            process.windowDelta(means, 29).to_dataframe(),
+        )
+
+    def pyramid():
+        means, _ = inputs['build']
+        return process.timePyramid(means, [600, 3600])
+
+    def save():
+        means, stdevs = inputs['fold']
+        process.saveSummary(f'{scratch}/summary.zarr', {'synthetic': means}, {'synthetic': stdevs})
+
+    stages = {
+        'header': header,
+        'parse': parse,
+        'resample': resample,
+        'ingest': ingest,
+        'build': builder(()),
+        'fold': builder(('Seed',)),
+        'aggregate': aggregate,
+        'pyramid': pyramid,
+        'save': save,
+    }
+    requirements = {
+        'resample': ['parse'],
+        'build': ['parse', 'resample'],
+        'fold': ['parse', 'resample'],
+        'aggregate': ['parse', 'resample', 'build'],
+        'pyramid': ['parse', 'resample', 'build'],
+        'save': ['parse', 'resample', 'fold'],
+    }
+    for name in ['parse', 'resample', 'build', 'fold']:
+        if any(name in requirements.get(stage, []) for stage in selected):
+            inputs[name] = stages[name]()
+    return stages
+
+
+def runBenchmarks(config, stages, workers, data=None):
+    """
+    Generates the synthetic sweep described by config and measures the selected stages on it.
+
+    Parameters
+    ----------
+    config : dict
+        seeds, thresholds, policies, rows, columns and samples of the synthetic sweep,
+        and repeats, the number of timed runs of each stage (the best one is reported)
+    stages : list of str
+        names of the stages to measure, see pipelineStages
+    workers : int, optional
+        size of the process pool of the ingest stage
+    data : str, optional
+        directory to keep the synthetic files in, a temporary one is used otherwise
+
+    Returns
+    -------
+    dict
+        The configuration, the size of the input, and the measurements of each stage
+    """
+    scratch = tempfile.mkdtemp(prefix='benchmark-')
+    try:
+        sweep = syntheticSweep(config['seeds'], config['thresholds'], config['policies'])
+        paths = generateData(data or f'{scratch}/data', sweep, config['rows'], config['columns'])
+        inputBytes = sum(os.path.getsize(path) for path in paths)
+        inputRows = len(paths) * config['rows']
+        timeline = np.linspace(0, 60.0 * (config['rows'] - 1), config['samples'])
+        available = pipelineStages(paths, timeline, workers, scratch, stages)
+        results = {}
+        for name in stages:
+            result = measure(available[name], config['repeats'])
+            result['rowsPerSecond'] = inputRows / result['seconds']
+            result['megabytesPerSecond'] = inputBytes / 1e6 / result['seconds']
+            results[name] = result
+        return {
+            'config': config,
+            'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+            'input': {'files': len(paths), 'rows': inputRows, 'bytes': inputBytes},
+            'stages': results,
+        }
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def compareWithBaseline(report, baseline, tolerance):
+    """
+    Returns the ratio between the current and the baseline time of each stage measured in both,
+    and the names of the stages slower than the baseline by more than tolerance.
+    """
+    ratios = {
+        name: result['seconds'] / baseline['stages'][name]['seconds']
+        for name, result in report['stages'].items()
+        if name in baseline['stages']
+    }
+    return ratios, [name for name, ratio in ratios.items() if ratio > 1 + tolerance]
+
+
+def printReport(report, ratios):
+    print(f"{report['input']['files']} files, {report['input']['rows']} rows, {report['input']['bytes'] / 1e6:.1f} MB")
+    print(f"{'stage':<10} {'seconds':>9} {'rows/s':>12} {'MB/s':>9} {'peak MB':>9} {'vs baseline':>12}")
+    for name, result in report['stages'].items():
+        ratio = f'{ratios[name]:.2f}x' if name in ratios else '-'
+        print(
+            f"{name:<10} {result['seconds']:>9.3f} {result['rowsPerSecond']:>12.0f} "
+            f"{result['megabytesPerSecond']:>9.1f} {result['peakMemory'] / 1e6:>9.1f} {ratio:>12}"
+        )
+
+
+if __name__ == '__main__':
+    baselineFile = 'benchmark_baseline.json'
+    stageNames = ['header', 'parse', 'resample', 'ingest', 'build', 'fold', 'aggregate', 'pyramid', 'save']
+
+    parser = argparse.ArgumentParser(description='Benchmarks the processing pipeline on synthetic Alchemist exports.')
+    parser.add_argument('--seeds', type=int, default=5)
+    parser.add_argument('--thresholds', type=int, default=6)
+    parser.add_argument('--policies', type=int, default=3)
+    parser.add_argument('--rows', type=int, default=962, help='data rows per file')
+    parser.add_argument('--columns', type=int, default=31, help='columns per file, including the time')
+    parser.add_argument('--samples', type=int, default=960, help='length of the resampled timeline')
+    parser.add_argument('--repeats', type=int, default=3, help='timed runs per stage, the best is reported')
+    parser.add_argument('--workers', type=int, default=None, help='process pool size of the ingest stage')
+    parser.add_argument('--stages', nargs='+', choices=stageNames, default=stageNames, metavar='STAGE')
+    parser.add_argument('--data', help='keep the synthetic files in this directory')
+    parser.add_argument('--baseline', default=baselineFile, help='baseline to compare with, if it exists')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='accepted slowdown before failing, 0.2 is 20%%')
+    arguments = parser.parse_args()
+    config = {k: getattr(arguments, k) for k in ['seeds', 'thresholds', 'policies', 'rows', 'columns', 'samples', 'repeats']}
+    report = runBenchmarks(config, arguments.stages, arguments.workers, arguments.data)
+    ratios, regressions = {}, []
+    if not arguments.save_baseline and os.path.exists(arguments.baseline):
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)
+        if baseline['config'] != config:
+            print(f'WARNING: {arguments.baseline} was measured on a different sweep or number of repeats, not comparing')
+        else:
+            ratios, regressions = compareWithBaseline(report, baseline, arguments.tolerance)
+    printReport(report, ratios)
+    if arguments.save_baseline:
+        with open(arguments.baseline, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f'Baseline saved to {arguments.baseline}')
+    if regressions:
+        print(f"Slower than the baseline by more than {arguments.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
@@ -38,6 +38,14 @@ multiJvm {
     jvmVersionForCompilation.set(usesJvm)
 }
 
+/*
+ * Entry point of the start scripts of installDist, used by sweep.py to run the simulations one at a time
+ */
+application {
+    mainClass.set("it.unibo.alchemist.Alchemist")
+    applicationDefaultJvmArgs = listOf("-Dsun.java2d.opengl=false")
+}
+
 dependencies {
     implementation(kotlin("stdlib-jdk8"))
     implementation(libs.bundles.alchemist.protelis)
@@ -1,15 +1,202 @@
-import numpy as np
-import xarray as xr
+import importlib.util
 import re
+import sys
 from pathlib import Path
 import collections
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import concurrent.futures
+import contextlib
+import functools
+import tempfile
+import time
+
+
+def lazyImport(name):
+    """
+    Imports a module deferring its execution to the first attribute access,
+    so that stages not needing it start faster.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+np = lazyImport('numpy')
+xr = lazyImport('xarray')
+
+
+class Instrumentation:
+    """
+    Records the wall time, CPU time, bytes read and peak resident memory of the stages of the pipeline.
+    Stages run on process pools are recorded by the workers and collected by the caller (see instrumented).
+    The peak resident memory is the one of the process since it started (ru_maxrss) when the stage ends:
+    it bounds the memory of the stage, but includes what earlier stages of the same process used.
 
+    Parameters
+    ----------
+    profile : str, optional
+        'cprofile' also profiles the code of each stage, 'tracemalloc' also traces its allocations
+    profileDirectory : str
+        where the per-stage profiles are dumped
+    """
+
+    def __init__(self, profile=None, profileDirectory='profiles'):
+        self.configure(profile, profileDirectory)
+
+    def configure(self, profile=None, profileDirectory='profiles'):
+        if profile not in (None, 'cprofile', 'tracemalloc'):
+            raise ValueError(f'Unknown profile {profile}, expected "cprofile" or "tracemalloc"')
+        self.profile = profile
+        self.profileDirectory = profileDirectory
+        self.records = []
+        self.totals = {}
+        self.profilers = {}
+        self.active = False
+        self.pid = os.getpid()
+
+    @staticmethod
+    def peakRss():
+        """
+        Returns the peak resident memory of the process over its lifetime, in bytes, or None if not available.
+        """
+        try:
+            import resource
+        except ImportError:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    @contextlib.contextmanager
+    def stage(self, name, item=None, bytesRead=0):
+        """
+        Records the enclosed code as a run of the stage name, optionally on a specific item (a file, a chart).
+        Yields the record, whose bytesRead can be updated when not known in advance.
+        Profiling is skipped for stages nested in other stages.
+        """
+        record = {'stage': name, 'item': item, 'bytesRead': bytesRead}
+        profiling = self.profile is not None and not self.active
+        self.active = True
+        if profiling and self.profile == 'cprofile':
+            import cProfile
+            profiler = self.profilers.setdefault(name, cProfile.Profile())
+            profiler.enable()
+        elif profiling:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['wallTime'] = time.perf_counter() - wall
+            record['cpuTime'] = time.process_time() - cpu
+            record['peakRss'] = self.peakRss()
+            record['pid'] = os.getpid()
+            if profiling and self.profile == 'cprofile':
+                profiler.disable()
+                Path(self.profileDirectory).mkdir(parents=True, exist_ok=True)
+                profiler.dump_stats(f'{self.profileDirectory}/{name}.{os.getpid()}.prof')
+            elif profiling:
+                import tracemalloc
+                record['tracedPeak'] = tracemalloc.get_traced_memory()[1]
+                Path(self.profileDirectory).mkdir(parents=True, exist_ok=True)
+                tracemalloc.take_snapshot().dump(f'{self.profileDirectory}/{name}.{os.getpid()}.tracemalloc')
+            if profiling:
+                self.active = False
+            self.records.append(record)
+
+    def drain(self):
+        records, self.records = self.records, []
+        return records
+
+    @staticmethod
+    def accumulate(stages, records):
+        for record in records:
+            total = stages.setdefault(record['stage'], {'runs': 0, 'wallTime': 0, 'cpuTime': 0, 'bytesRead': 0, 'peakRss': None})
+            total['runs'] += 1
+            for key in ('wallTime', 'cpuTime', 'bytesRead'):
+                total[key] += record[key]
+            if record['peakRss'] is not None:
+                total['peakRss'] = max(total['peakRss'] or 0, record['peakRss'])
+        return stages
+
+    def fold(self):
+        """
+        Adds the records to the totals of their stages and releases them, so that long runs use constant memory.
+        The runs folded are counted in the report, but not listed.
+        """
+        self.accumulate(self.totals, self.drain())
+
+    def report(self):
+        """
+        Returns
+        -------
+        dict
+            The totals of each stage, and every recorded run not folded
+        """
+        stages = self.accumulate({stage: dict(total) for stage, total in self.totals.items()}, self.records)
+        return {'profile': self.profile, 'stages': stages, 'records': self.records}
+
+    def save(self, path):
+        """
+        Writes the report as JSON. With cProfile, the profiles of each process are also merged into one per stage.
+        """
+        if self.profile == 'cprofile':
+            import pstats
+            for stage in {record['stage'] for record in self.records}:
+                dumps = sorted(Path(self.profileDirectory).glob(f'{stage}.*.prof'))
+                if dumps:
+                    pstats.Stats(*map(str, dumps)).dump_stats(f'{self.profileDirectory}/{stage}.prof')
+                    for dump in dumps:
+                        dump.unlink()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(self.report(), file, indent=2)
+        os.replace(f'{path}.tmp', path)
+
+
+instrumentation = Instrumentation()
+
+
+def instrumented(function, profile, profileDirectory, *args, **kwargs):
+    """
+    Runs function in a pool worker with the instrumentation configured as in the caller.
 
-def distance(val, ref):
-    return abs(ref - val)
+    Returns
+    -------
+    tuple
+        The result of function, and the records of the stages it ran, to be collected with Instrumentation.records
+    """
+    # Forked workers inherit the records of the caller, spawned ones start from the default configuration
+    if instrumentation.pid != os.getpid() or (instrumentation.profile, instrumentation.profileDirectory) != (profile, profileDirectory):
+        instrumentation.configure(profile, profileDirectory)
+    result = function(*args, **kwargs)
+    return result, instrumentation.drain()
 
 
-vectDistance = np.vectorize(distance)
+def instrumentedMap(executor, function, iterable):
+    """
+    Maps function on a process pool like executor.map, collecting the records of the stages run by the workers.
+    """
+    job = functools.partial(instrumented, function, instrumentation.profile, instrumentation.profileDirectory)
+    for result, records in executor.map(job, iterable):
+        instrumentation.records.extend(records)
+        yield result
 
 
 def cmap_xmap(function, cmap):
@@ -24,28 +211,57 @@ def cmap_xmap(function, cmap):
         cdict[key] = map(function_to_map, cdict[key])
     #        cdict[key].sort()
     #        assert (cdict[key][0]<0 or cdict[key][-1]>1), "Resulting indices extend out of the [0, 1] segment."
+    import matplotlib.colors
     return matplotlib.colors.LinearSegmentedColormap('colormap', cdict, 1024)
 
 
-def getClosest(sortedMatrix, column, val):
-    while len(sortedMatrix) > 3:
-        half = int(len(sortedMatrix) / 2)
-        sortedMatrix = sortedMatrix[-half - 1:] if sortedMatrix[half, column] < val else sortedMatrix[: half + 1]
-    if len(sortedMatrix) == 1:
-        result = sortedMatrix[0].copy()
-        result[column] = val
-        return result
-    else:
-        safecopy = sortedMatrix.copy()
-        safecopy[:, column] = vectDistance(safecopy[:, column], val)
-        minidx = np.argmin(safecopy[:, column])
-        safecopy = safecopy[minidx, :].A1
-        safecopy[column] = val
-        return safecopy
+def convert(column, samples, matrix, interpolation='nearest'):
+    """
+    Resamples an Alchemist matrix on a new timeline, in a single vectorized pass.
+
+    Parameters
+    ----------
+    column : int
+        index of the (sorted) time column
+    samples : array-like
+        the sorted timeline to resample on
+    matrix : np.ndarray
+        the raw data, one row per exported time instant
+    interpolation : str
+        'nearest' picks, for each sample, the row whose time is closest (ties go to the earlier row,
+        samples outside the exported range get the first or last row);
+        'linear' interpolates linearly between the two rows surrounding each sample.
+        Rows with the same time resolve to the earliest of them, where the former bisection could pick a later one:
+        results differ from it when the time stamps repeat
 
+    Returns
+    -------
+    np.ndarray
+        A matrix with one row per sample, whose time column holds the samples
 
-def convert(column, samples, matrix):
-    return np.matrix([getClosest(matrix, column, t) for t in samples])
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    samples = np.asarray(samples, dtype=float)
+    times = matrix[:, column]
+    after = np.clip(np.searchsorted(times, samples, side='left'), 1, len(times) - 1)
+    # On duplicated time stamps, prefer the earliest row
+    before = np.searchsorted(times, times[after - 1], side='left')
+    if len(times) == 1:
+        result = matrix[np.zeros(len(samples), dtype=int)]
+    elif interpolation == 'nearest':
+        pickAfter = np.abs(times[after] - samples) < np.abs(samples - times[before])
+        result = matrix[np.where(pickAfter, after, before)]
+    elif interpolation == 'linear':
+        span = times[after] - times[before]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.clip(np.where(span > 0, (samples - times[before]) / span, 0.0), 0.0, 1.0)[:, np.newaxis]
+        result = matrix[before] * (1 - weight) + matrix[after] * weight
+        # Avoid NaN * 0 contaminating samples that fall exactly on a row
+        result = np.where(weight == 0, matrix[before], np.where(weight == 1, matrix[after], result))
+    else:
+        raise ValueError(f'Unknown interpolation {interpolation}, expected "nearest" or "linear"')
+    result[:, column] = samples
+    return result
 
 
 def valueOrEmptySet(k, d):
@@ -68,15 +284,107 @@ def mergeDicts(d1, d2):
     -------
     dict
         A dict whose keys are the union of the keys of two dictionaries,
-    and whose values are the union of values
+    and whose values are the union of values. Keys keep their order of appearance.
 
     """
     res = {}
-    for k in d1.keys() | d2.keys():
+    for k in [*d1.keys(), *(k for k in d2.keys() if k not in d1)]:
         res[k] = valueOrEmptySet(k, d1) | valueOrEmptySet(k, d2)
     return res
 
 
+class Header(collections.namedtuple('Header', ['coordinates', 'columns', 'dataOffset'])):
+    """
+    Metadata of an Alchemist export file.
+
+    Attributes
+    ----------
+    coordinates : dict
+        the variables of the experiment, by name (str) to value (float, bool, or str)
+    columns : list of str
+        the column names
+    dataOffset : int
+        byte offset at which the numeric block starts
+    """
+    __slots__ = ()
+
+
+# Headers memoized: files still being written get a new entry at every change, the oldest ones are dropped
+headerCacheSize = 4096
+
+
+def _parseCoordinates(line):
+    coordinatesRegex = r"(?P<varName>[a-zA-Z._-]+) = (?P<varValue>(?:\[[^\]]*\]|[^,]*)),?"
+    is_float = r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?"
+    return {
+        var: float(value) if re.match(is_float, value)
+        else bool(re.match(r".*?true.*?", value.lower())) if re.match(r".*?(true|false).*?", value.lower())
+        else value.replace('\n', '')
+        for var, value in re.findall(coordinatesRegex, line.replace('Infinity', '1e30000'))
+    }
+
+
+@functools.lru_cache(maxsize=headerCacheSize)
+def _parseHeader(filename, size, mtime):
+    coordinates = None
+    lastHeaderLine = ''
+    dataOffset = 0
+    with instrumentation.stage('header', filename) as record, open(filename, 'rb') as file:
+        for rawLine in iter(file.readline, b''):
+            if rawLine[:1].isdigit():
+                break
+            dataOffset += len(rawLine)
+            lastHeaderLine = rawLine.decode()
+            if coordinates is None:
+                coordinates = _parseCoordinates(lastHeaderLine) or None
+        record['bytesRead'] = dataOffset
+    return Header(coordinates or {}, re.findall(r' (?P<varName>\S+)', lastHeaderLine), dataOffset)
+
+
+@functools.lru_cache(maxsize=headerCacheSize)
+def _parseBinaryHeader(filename, size, mtime):
+    with instrumentation.stage('header', filename) as record:
+        with open(binaryDescriptor(filename)) as file:
+            descriptor = json.load(file)
+        with open(filename, 'rb') as file:
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                np.lib.format.read_array_header_1_0(file)
+            else:
+                np.lib.format.read_array_header_2_0(file)
+            dataOffset = file.tell()
+        record['bytesRead'] = dataOffset
+    return Header(_parseCoordinates(descriptor['variables']), descriptor['columns'], dataOffset)
+
+
+def binaryDescriptor(filename):
+    """
+    Returns the path of the JSON descriptor of a binary export (see openBinary).
+    """
+    return filename[:-len('.npy')] + '.json'
+
+
+def readHeader(filename):
+    """
+    Reads the header of an Alchemist file in a single pass, or the descriptor of a binary export (see openBinary).
+    Results are memoized until the file changes (the headerCacheSize headers read last).
+
+    Parameters
+    ----------
+    filename : str
+        path to the target file
+
+    Returns
+    -------
+    Header
+        The coordinates, the column names, and the offset of the data in the file
+
+    """
+    stat = os.stat(filename)
+    parse = _parseBinaryHeader if filename.endswith('.npy') else _parseHeader
+    return parse(filename, stat.st_size, stat.st_mtime)
+
+
 def extractCoordinates(filename):
     """
     Scans the header of an Alchemist file in search of the variables.
@@ -85,8 +393,6 @@ def extractCoordinates(filename):
     ----------
     filename : str
         path to the target file
-    mergewith : dict
-        a dictionary whose dimensions will be merged with the returned one
 
     Returns
     -------
@@ -95,22 +401,7 @@ def extractCoordinates(filename):
         lists (set of variable values)
 
     """
-    with open(filename, 'r') as file:
-        #        regex = re.compile(' (?P<varName>[a-zA-Z._-]+) = (?P<varValue>[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?),?')
-        regex = r"(?P<varName>[a-zA-Z._-]+) = (?P<varValue>(?:\[[^\]]*\]|[^,]*)),?"
-        dataBegin = r"\d"
-        is_float = r"[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?"
-        for line in file:
-            match = re.findall(regex, line.replace('Infinity', '1e30000'))
-            if match:
-                return {
-                    var: float(value) if re.match(is_float, value)
-                    else bool(re.match(r".*?true.*?", value.lower())) if re.match(r".*?(true|false).*?", value.lower())
-                    else value.replace('\n', '')
-                    for var, value in match
-                }
-            elif re.match(dataBegin, line[0]):
-                return {}
+    return dict(readHeader(filename).coordinates)
 
 
 def extractVariableNames(filename):
@@ -124,43 +415,1020 @@ def extractVariableNames(filename):
 
     Returns
     -------
-    list of list
-        A matrix with the values of the csv file
+    list of str
+        The names of the columns
 
     """
-    with open(filename, 'r') as file:
-        dataBegin = re.compile(r'\d')
-        lastHeaderLine = ''
-        for line in file:
-            if dataBegin.match(line[0]):
-                break
-            else:
-                lastHeaderLine = line
-        if lastHeaderLine:
-            regex = re.compile(r' (?P<varName>\S+)')
-            return regex.findall(lastHeaderLine)
-        return []
+    return list(readHeader(filename).columns)
 
 
-def openCsv(path):
+def openCsv(path, columns=None):
     """
-    Converts an Alchemist export file into a list of lists representing the matrix of values.
+    Parses the numeric block of an Alchemist export file into a float64 matrix.
+    Header and footer lines (starting with #) are skipped, NaN and Infinity are supported.
 
     Parameters
     ----------
     path : str
         path to the target file
+    columns : list of str or int, optional
+        the columns to parse, either by name or by index, in the desired order.
+        If None, all columns are parsed
+
+    Returns
+    -------
+    np.ndarray
+        A contiguous matrix with the values of the csv file, one row per line
+
+    """
+    header = readHeader(path)
+    if columns is not None:
+        columns = [header.columns.index(c) if isinstance(c, str) else c for c in columns]
+    with instrumentation.stage('parse', path, os.path.getsize(path) - header.dataOffset), open(path, 'rb') as file:
+        file.seek(header.dataOffset)
+        return np.loadtxt(file, dtype=np.float64, comments='#', usecols=columns, ndmin=2)
+
+
+def writeCsv(path, coordinates, columns, matrix, started=None, finished=None):
+    """
+    Writes a matrix in the format of the Alchemist CSV exporter, atomically.
+
+    Parameters
+    ----------
+    path : str
+        path of the file to create
+    coordinates : dict
+        the variables of the experiment, written in the header
+    columns : list of str
+        the column names
+    matrix : np.ndarray
+        the values, one row per exported time instant
+    started, finished : datetime.datetime, optional
+        the times written in the header and in the footer, now if None
+    """
+    import datetime
+    now = datetime.datetime.now(datetime.timezone.utc)
+    started, finished = (moment or now for moment in (started, finished))
+    rule = '#' * 69
+    header = '\n'.join([
+        rule,
+        f"# Alchemist log file - simulation started at: {started.strftime('%Y-%m-%dT%H:%M%z')} #",
+        rule,
+        '#',
+        '# ' + ', '.join(f'{k} = {v}' for k, v in coordinates.items()),
+        '#',
+        '# The columns have the following meaning: ',
+        '# ' + ' '.join(columns) + ' ',
+    ])
+    footer = '\n'.join([rule, f"# End of data export. Simulation finished at: {finished.strftime('%Y-%m-%dT%H:%M%z')} #", rule])
+    np.savetxt(f'{path}.tmp', matrix, fmt='%.17g', header=header, footer=footer, comments='')
+    os.replace(f'{path}.tmp', path)
+
+
+def openBinary(path, columns=None):
+    """
+    Memory-maps a binary export written by the NpyExporter of the simulation: a little-endian float64 .npy matrix,
+    with a JSON descriptor holding the variables and the column names. No parsing takes place.
+    The number of rows is derived from the size of the file, so that exports still being written can be read:
+    trailing incomplete rows are excluded.
+
+    Parameters
+    ----------
+    path : str
+        path to the .npy file
+    columns : list of str or int, optional
+        the columns to read, see openCsv. If None, the whole matrix is mapped without copies
+
+    Returns
+    -------
+    np.ndarray
+        The matrix, one row per exported time instant
+
+    """
+    header = readHeader(path)
+    width = len(header.columns)
+    rows = (os.path.getsize(path) - header.dataOffset) // (8 * width)
+    if rows == 0:
+        matrix = np.empty((0, width))
+    else:
+        matrix = np.memmap(path, dtype='<f8', mode='r', offset=header.dataOffset, shape=(rows, width))
+    if columns is None:
+        return matrix
+    columns = [header.columns.index(c) if isinstance(c, str) else c for c in columns]
+    with instrumentation.stage('parse', path, 8 * rows * len(columns)):
+        return matrix[:, columns]
+
+
+def openExport(path, columns=None):
+    """
+    Reads an Alchemist export, either a CSV file (see openCsv) or a binary one (see openBinary).
+    """
+    return (openBinary if path.endswith('.npy') else openCsv)(path, columns)
+
+
+def ingestFile(path, columns, timeColumn, timeline, interpolation='nearest'):
+    """
+    Loads an Alchemist export file and resamples it on the given timeline.
+
+    Parameters
+    ----------
+    path : str
+        path to the target file
+    columns : list of str or int
+        the columns to load, see openCsv
+    timeColumn : int
+        index of the time column among the loaded ones
+    timeline : array-like
+        the timeline to resample on
+    interpolation : str
+        resampling strategy, see convert
+
+    Returns
+    -------
+    tuple of dict and np.ndarray
+        The coordinates of the experiment and the resampled matrix
+
+    """
+    coordinates, matrix = extractCoordinates(path), openExport(path, columns)
+    with instrumentation.stage('resample', path):
+        return coordinates, convert(timeColumn, timeline, matrix, interpolation)
+
+
+def ingestFiles(paths, columns, timeColumn, timeline, interpolation='nearest', workers=None):
+    """
+    Runs ingestFile on every path, in parallel on a process pool.
+    Results are produced in the same order as paths, regardless of the number of workers.
+
+    Parameters
+    ----------
+    paths : list of str
+        paths to the target files
+    columns, timeColumn, timeline, interpolation
+        see ingestFile
+    workers : int, optional
+        size of the process pool: None uses every available core, 1 runs in the current process
+
+    Yields
+    ------
+    tuple
+        The results of ingestFile, one per path, as soon as they are available
+
+    """
+    job = functools.partial(ingestFile, columns=columns, timeColumn=timeColumn, timeline=timeline, interpolation=interpolation)
+    if workers == 1 or len(paths) <= 1:
+        yield from map(job, paths)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from instrumentedMap(executor, job, paths)
+
+
+class ResampleCache:
+    """
+    Persistent per-file cache of resampled matrices.
+    Entries are keyed by the path of the source file, and are valid as long as the size, modification time
+    (or, failing those, the content hash) of the file and the resampling settings are unchanged.
+
+    Parameters
+    ----------
+    directory : str
+        where to store the cache
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        try:
+            with open(self.directory / 'index', 'rb') as index:
+                self.entries = pickle.load(index)
+        except Exception:
+            self.entries = {}
+
+    @staticmethod
+    def contentHash(path):
+        digest = hashlib.blake2b()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get(self, path, settings):
+        """
+        Returns the cached coordinates and (memory-mapped) resampled matrix of path, or None if missing or stale.
+        """
+        entry = self.entries.get(path)
+        if entry is None or entry['settings'] != settings:
+            return None
+        stat = os.stat(path)
+        if (entry['size'], entry['mtime']) != (stat.st_size, stat.st_mtime):
+            if entry['size'] != stat.st_size or entry['hash'] != self.contentHash(path):
+                return None
+            entry['mtime'] = stat.st_mtime
+        try:
+            return entry['coordinates'], np.load(self.directory / entry['array'], mmap_mode='r')
+        except OSError:
+            return None
+
+    def put(self, path, settings, coordinates, matrix):
+        stat = os.stat(path)
+        array = hashlib.blake2b(path.encode(), digest_size=16).hexdigest() + '.npy'
+        np.save(self.directory / array, matrix)
+        self.entries[path] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'hash': self.contentHash(path),
+            'settings': settings,
+            'coordinates': coordinates,
+            'array': array,
+        }
+
+    def evict(self, existing):
+        """
+        Drops the entries whose source file is not among the existing ones, returning their paths.
+        """
+        stale = [path for path in self.entries if path not in existing]
+        for path in stale:
+            (self.directory / self.entries.pop(path)['array']).unlink(missing_ok=True)
+        return stale
+
+    def save(self):
+        with open(self.directory / 'index.tmp', 'wb') as index:
+            pickle.dump(self.entries, index, protocol=-1)
+        os.replace(self.directory / 'index.tmp', self.directory / 'index')
+
+
+EXPORT_EXTENSIONS = ('.csv', '.npy')
+
+
+class FileIndex:
+    """
+    Persistent index of the Alchemist export files of a directory and of their coordinates.
+    Coordinates are read from the file names, shaped as {experiment}_{name}-{value}_{name}-{value}.csv,
+    and verified against the headers, which prevail. Headers are also the fallback for names not following the pattern.
+    Binary exports (.npy, see openBinary) are indexed as well, and replace the CSV files with the same name.
+    Files are examined again only when the size or modification time reported by os.scandir change.
+
+    Parameters
+    ----------
+    directory : str
+        the directory of the data files
+    path : str
+        where to store the index
+    verify : bool
+        whether to check the names of new or changed files against their headers
+    """
+
+    def __init__(self, directory, path, verify=True):
+        self.directory = directory
+        self.path = Path(path)
+        self.verify = verify
+        try:
+            with open(self.path, 'rb') as index:
+                self.entries = pickle.load(index)
+        except Exception:
+            self.entries = {}
+
+    @staticmethod
+    def parseValue(value):
+        """
+        Converts a coordinate value as written in a file name to float, bool, or str, as the header parser does.
+        """
+        if value.lower() in ('true', 'false'):
+            return value.lower() == 'true'
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+    @staticmethod
+    def parseName(name):
+        """
+        Returns the coordinates encoded in a file name, or None if the name does not follow the pattern.
+        """
+        stem, extension = os.path.splitext(name)
+        if extension not in EXPORT_EXTENSIONS:
+            return None
+        parts = stem.split('_')
+        first = next((idx for idx, part in enumerate(parts) if '-' in part), None)
+        if first is None or first == 0:
+            return None
+        coordinates = {}
+        for part in parts[first:]:
+            key, separator, value = part.partition('-')
+            if not separator or not key:
+                return None
+            coordinates[key] = FileIndex.parseValue(value)
+        return coordinates
+
+    def examine(self, path, name):
+        coordinates = self.parseName(name)
+        if coordinates is None or self.verify:
+            header = readHeader(path).coordinates
+            if coordinates is not None and header and header != coordinates:
+                print(f'WARNING: the coordinates in the name of {path} differ from its header, using the header')
+            if header or coordinates is None:
+                coordinates = dict(header)
+        return coordinates
+
+    def refresh(self):
+        """
+        Updates the index with the files added, changed or removed since the last refresh, and saves it if needed.
+        """
+        entries = {}
+        try:
+            with os.scandir(self.directory) as scan:
+                for item in scan:
+                    if not item.name.endswith(EXPORT_EXTENSIONS) or not item.is_file():
+                        continue
+                    path = f'{self.directory}/{item.name}'
+                    if path.endswith('.npy') and not os.path.exists(binaryDescriptor(path)):
+                        continue
+                    stat = item.stat()
+                    entry = self.entries.get(path)
+                    if entry is None or (entry['size'], entry['mtime']) != (stat.st_size, stat.st_mtime):
+                        entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'coordinates': self.examine(path, item.name)}
+                    entries[path] = entry
+        except FileNotFoundError:
+            pass
+        entries = {
+            path: entry for path, entry in entries.items()
+            if not path.endswith('.csv') or f"{path[:-len('.csv')]}.npy" not in entries
+        }
+        if entries != self.entries:
+            self.entries = entries
+            self.save()
+
+    def coordinates(self, path):
+        return dict(self.entries[path]['coordinates'])
+
+    def select(self, experiment=None, **coordinates):
+        """
+        Returns the sorted paths of the indexed files of experiment (of every experiment if None)
+        matching the given coordinates, each one either a value or a list, tuple or set of accepted values.
+        For instance, select('dynamic', SwapPolicy='hybrid').
+        """
+        accepted = {k: v if isinstance(v, (list, tuple, set)) else [v] for k, v in coordinates.items()}
+        prefix = f'{self.directory}/{experiment}_' if experiment is not None else ''
+        return sorted(
+            path for path, entry in self.entries.items()
+            if path.startswith(prefix)
+            and all(k in entry['coordinates'] and entry['coordinates'][k] in values for k, values in accepted.items())
+        )
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f'{self.path}.tmp', 'wb') as index:
+            pickle.dump(self.entries, index, protocol=-1)
+        os.replace(f'{self.path}.tmp', self.path)
+
+
+class TailFollower:
+    """
+    Follows an Alchemist export while the simulation writes it, parsing only the rows appended since the last poll,
+    and resampling only the samples of the timeline that they complete.
+    A sample is complete once a row at or after its time has been exported: later rows cannot be closer to it.
+
+    Parameters
+    ----------
+    path : str
+        path to the followed file
+    timeColumnName : str
+        name of the time column
+    timeline : np.ndarray
+        the timeline to resample on
+    interpolation : str
+        resampling strategy, see convert
+    columns : list of str, optional
+        the columns to load besides the time, all if None
+    """
+
+    def __init__(self, path, timeColumnName, timeline, interpolation='nearest', columns=None):
+        self.path = path
+        self.timeColumnName = timeColumnName
+        self.timeline = timeline
+        self.interpolation = interpolation
+        self.selection = columns
+        # Times the file has been found truncated, for consumers to discard what they got from it
+        self.resets = 0
+        self.reset()
+
+    def reset(self):
+        # offset is None until the header has been written entirely
+        self.offset = None
+        self.coordinates = None
+        self.columns = None
+        self.usecols = None
+        self.width = None
+        self.timeColumn = None
+        self.matrix = None
+        self.resampled = None
+        self.ready = 0
+        self.finished = False
+
+    def poll(self):
+        """
+        Parses the rows appended since the last poll. If the file has been truncated, starts over.
+
+        Returns
+        -------
+        slice or None
+            The samples of resampled completed by the new rows, None if there are none
+        """
+        size = os.path.getsize(self.path)
+        if self.offset is not None and size < self.offset:
+            self.resets += 1
+            self.reset()
+        if self.offset is None:
+            header = readHeader(self.path)
+            if header.dataOffset >= size:
+                return None
+            self.coordinates = dict(header.coordinates)
+            self.columns = [c for c in header.columns if self.selection is None or c == self.timeColumnName or c in self.selection]
+            self.usecols = [header.columns.index(c) for c in self.columns]
+            self.width = len(header.columns)
+            self.timeColumn = self.columns.index(self.timeColumnName)
+            self.matrix = np.empty((0, len(self.columns)))
+            self.resampled = np.full((len(self.timeline), len(self.columns)), np.nan)
+            self.offset = header.dataOffset
+        with instrumentation.stage('tail', self.path) as record:
+            rows = self.readBinary() if self.path.endswith('.npy') else self.readText(size)
+            record['bytesRead'] = rows.nbytes
+            if len(rows):
+                self.matrix = np.vstack([self.matrix, rows])
+        if len(self.matrix) == 0:
+            return None
+        times = self.matrix[:, self.timeColumn]
+        end = len(self.timeline) if self.finished else np.searchsorted(self.timeline, times[-1], side='right')
+        if end <= self.ready:
+            return None
+        update = slice(self.ready, end)
+        with instrumentation.stage('resample', self.path):
+            self.resampled[update] = convert(self.timeColumn, self.timeline[update], self.matrix[self.precedingRow(times):], self.interpolation)
+        self.ready = end
+        # Earlier rows are not needed by the samples still to complete
+        self.matrix = self.matrix[self.precedingRow(times):] if self.ready < len(self.timeline) else self.matrix[:0]
+        return update
+
+    def precedingRow(self, times):
+        """
+        Returns the index of the last row preceding the first sample not resampled yet (of its first occurrence,
+        as convert does): resampling that sample and the next ones reads only the rows from there on.
+        """
+        first = max(np.searchsorted(times, self.timeline[self.ready], side='left') - 1, 0)
+        return np.searchsorted(times, times[first], side='left')
+
+    def readText(self, size):
+        with open(self.path, 'rb') as file:
+            file.seek(self.offset)
+            chunk = file.read(size - self.offset)
+        # A line is parsed only once the exporter has terminated it
+        chunk = chunk[:chunk.rfind(b'\n') + 1]
+        self.offset += len(chunk)
+        lines = chunk.decode().splitlines()
+        self.finished = self.finished or any(line.startswith('#') for line in lines)
+        rows = [line for line in lines if line[:1].isdigit()]
+        if not rows:
+            return np.empty((0, len(self.columns)))
+        return np.loadtxt(rows, dtype=np.float64, usecols=self.usecols, ndmin=2)
+
+    def readBinary(self):
+        # The descriptor is marked finished after the last row is written: reading it first, no row can be missed
+        with open(binaryDescriptor(self.path)) as descriptor:
+            self.finished = json.load(descriptor)['finished']
+        rows = (os.path.getsize(self.path) - self.offset) // (8 * self.width)
+        matrix = np.fromfile(self.path, dtype='<f8', count=rows * self.width, offset=self.offset).reshape(rows, self.width)
+        self.offset += matrix.nbytes
+        return matrix[:, self.usecols]
+
+
+def blocks(shape, itemsize, budget=8 * 2 ** 20):
+    """
+    Splits an array of the given shape into slices along its first axis of at most budget bytes each (but one row).
+    """
+    rowBytes = itemsize * int(np.prod(shape[1:]))
+    rows = max(1, budget // max(1, rowBytes))
+    return [slice(start, start + rows) for start in range(0, shape[0], rows)] if shape else [slice(None)]
+
+
+class DatasetBuilder:
+    """
+    Collects the resampled matrices of an experiment into dense arrays shaped (coordinates..., time, variable),
+    and wraps them into Datasets once complete.
+    Seed variables are folded while matrices are added, keeping running mean and variance (Welford's algorithm),
+    so that experiments differing only by seed are never held in memory at the same time.
+
+    Parameters
+    ----------
+    dimensions : dict
+        the coordinate names, mapped to their sorted values
+    columns : list of str
+        the column names of the matrices that will be added
+    timeline : np.ndarray
+        the timeline the matrices have been resampled on
+    timeColumnName : str
+        name of the time column, which becomes the innermost coordinate
+    seedVars : list of str
+        the coordinates to fold, NaN values are skipped
+    dtype : np.dtype
+        type of the stored values, float32 halves the memory footprint. Running statistics are always float64
+    backing : str, optional
+        if provided, the arrays are memory-mapped on files with this prefix rather than allocated in memory
+    runs : list of dict, optional
+        if provided, the coordinates of the experiments that will be added: the arrays are shaped (run, time, variable)
+        with one run per observed combination of the (non-seed) coordinates, rather than spanning their whole grid.
+        The run dimension is indexed by a MultiIndex of the coordinates
+    """
+
+    def __init__(self, dimensions, columns, timeline, timeColumnName='time', seedVars=(), dtype='float64', backing=None, runs=None):
+        self.dimensions = {k: v for k, v in dimensions.items() if k not in seedVars}
+        self.timeline = timeline
+        self.timeColumnName = timeColumnName
+        self.folding = any(seed in dimensions for seed in seedVars)
+        self.variables = [column for column in columns if column != timeColumnName]
+        self.variableColumns = [idx for idx, column in enumerate(columns) if column != timeColumnName]
+        self.positions = {k: {value: idx for idx, value in enumerate(v)} for k, v in self.dimensions.items()}
+        self.shape = tuple(len(v) for v in self.dimensions.values()) + (len(timeline), len(self.variables))
+        self.runs = None
+        if runs is not None:
+            combinations = {tuple(run.get(k) for k in self.dimensions) for run in runs}
+            combinations = sorted(combinations, key=lambda c: tuple(self.positions[k].get(v, -1) for k, v in zip(self.dimensions, c)))
+            self.runs = {combination: idx for idx, combination in enumerate(combinations)}
+            self.shape = (len(combinations), len(timeline), len(self.variables))
+        self.backing = backing
+        self.dtype = dtype
+        if self.folding:
+            self.values = self.allocate('mean', np.float64, 0)
+            self.squares = self.allocate('m2', np.float64, 0)
+            self.count = self.allocate('count', np.int32, 0)
+        else:
+            self.values = self.allocate('mean', dtype, np.nan)
+
+    def allocate(self, name, dtype, fill=None):
+        if self.backing is None:
+            array = np.empty(self.shape, dtype=dtype)
+        else:
+            array = np.lib.format.open_memmap(f'{self.backing}.{name}.npy', mode='w+', dtype=dtype, shape=self.shape)
+        if fill is not None:
+            array.fill(fill)
+        return array
+
+    def add(self, coordinates, matrix, start=0):
+        """
+        Writes or folds the matrix of an experiment at its coordinates, with a single assignment per array.
+        Coordinates missing from the experiment span their whole dimension.
+        The matrix may cover only part of the timeline, starting from the sample at index start.
+        """
+        if self.runs is not None:
+            index = (self.runs[tuple(coordinates.get(k) for k in self.dimensions)],)
+        else:
+            index = tuple(
+                self.positions[k][coordinates[k]] if k in coordinates else slice(None)
+                for k in self.dimensions
+            )
+        index += (slice(start, start + len(matrix)),)
+        values = matrix[:, self.variableColumns]
+        if not self.folding:
+            self.values[index] = values
+            return
+        valid = ~np.isnan(values)
+        mean = self.values[index]
+        count = self.count[index]
+        count += valid
+        delta = np.where(valid, values - mean, 0)
+        mean += np.divide(delta, count, out=np.zeros_like(delta), where=count > 0)
+        self.squares[index] += np.where(valid, delta * (values - mean), 0)
+
+    def build(self):
+        """
+        Returns
+        -------
+        tuple of xr.Dataset
+            The mean and the (population) standard deviation along the seed variables.
+            Both are written through allocate, block by block, so that with backing they stay on disk.
+            Without seed variables the standard deviation is a read-only broadcast of zero
+        """
+        if not self.folding:
+            return self.wrap(self.values), self.wrap(np.broadcast_to(np.zeros((), dtype=self.values.dtype), self.shape))
+        mean = self.allocate('folded.mean', self.dtype)
+        stdev = self.allocate('folded.std', self.dtype)
+        for block in blocks(self.shape, np.dtype(np.float64).itemsize):
+            count = self.count[block]
+            populated = count > 0
+            mean[block] = np.where(populated, self.values[block], np.nan)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                stdev[block] = np.where(populated, np.sqrt(self.squares[block] / count), np.nan)
+        return self.wrap(mean), self.wrap(stdev)
+
+    def wrap(self, values):
+        if self.runs is not None:
+            import pandas as pd
+            dims = ('run', self.timeColumnName)
+            index = pd.MultiIndex.from_tuples(list(self.runs), names=list(self.dimensions))
+            coords = xr.Coordinates.from_pandas_multiindex(index, 'run').assign({self.timeColumnName: self.timeline})
+        else:
+            dims = (*self.dimensions.keys(), self.timeColumnName)
+            coords = {**self.dimensions, self.timeColumnName: self.timeline}
+        return xr.Dataset(
+            {v: (dims, values[..., idx]) for idx, v in enumerate(self.variables)},
+            coords=coords,
+        )
+
+
+PYRAMID_STATISTICS = ['min', 'max', 'mean', 'last', 'sum']
+
+
+def timePyramid(dataset, resolutions, dim='time'):
+    """
+    Summarizes the time series of a dataset over buckets of coarser and coarser resolutions.
+    Each bucket holds the minimum, maximum, mean, last value and sum of its samples (see PYRAMID_STATISTICS),
+    ignoring NaN values but for the last one, and is stamped with the time of its last sample.
+    The maximum and sum of a whole series are those of its buckets, so that the coarsest level answers them
+    reading a handful of samples.
+
+    Parameters
+    ----------
+    dataset : xr.Dataset
+        the time series, with a dim coordinate
+    resolutions : list of float
+        the widths of the buckets, in the units of dim, starting from its first value
+    dim : str
+        the time dimension
+
+    Returns
+    -------
+    dict
+        Resolution to a Dataset with the variables of dataset, their buckets along dim,
+        and a last dimension 'statistic'
+    """
+    times = dataset[dim].values
+    levels = {}
+    for resolution in resolutions:
+        buckets = np.floor((times - times[0]) / resolution)
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        ends = np.r_[starts[1:], len(times)] - 1
+        series = [name for name, variable in dataset.data_vars.items() if dim in variable.dims]
+        level = dataset.drop_vars(series).isel({dim: ends})
+        for name in series:
+            variable = dataset[name].variable
+            axis = variable.dims.index(dim)
+            shape = list(variable.shape)
+            shape[axis] = len(starts)
+            bucketed = np.empty((*shape, len(PYRAMID_STATISTICS)), dtype=variable.dtype)
+            # Memory-mapped variables are read a block of the first axis at a time
+            for block in blocks(variable.shape, variable.dtype.itemsize) if axis else [slice(None)]:
+                values = np.asarray(variable.data[block])
+                missing = np.isnan(values)
+                sums = np.add.reduceat(np.where(missing, 0, values), starts, axis=axis)
+                counts = np.add.reduceat(~missing, starts, axis=axis)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    means = sums / counts
+                statistics = [
+                    np.fmin.reduceat(values, starts, axis=axis),
+                    np.fmax.reduceat(values, starts, axis=axis),
+                    means,
+                    values.take(ends, axis=axis),
+                    sums,
+                ]
+                bucketed[block] = np.stack(statistics, axis=-1)
+            level[name] = ((*variable.dims, 'statistic'), bucketed)
+        levels[resolution] = level.assign_coords(statistic=PYRAMID_STATISTICS)
+    return levels
+
+
+def pyramidGroup(experiment, resolution):
+    return f'{experiment}/pyramid/{resolution}'
+
+
+def saveSummary(path, means, stdevs, chunks=16, resolutions=(), dim='time'):
+    """
+    Persists the mean and standard deviation datasets of each experiment in a compressed Zarr store,
+    with one group per experiment and statistic, and one more per level of the time pyramid of the means
+    (see timePyramid and loadPyramid). The store is replaced atomically.
+    MultiIndex dimensions (see DatasetBuilder runs) are stored as their levels, and restored by loadSummary.
+    Variables are split in chunks along their first dimension, so that updateSummary rewrites only the chunks it touches.
+
+    Parameters
+    ----------
+    path : str
+        the Zarr store
+    means : dict
+        experiment name to mean Dataset
+    stdevs : dict
+        experiment name to standard deviation Dataset
+    chunks : int
+        number of chunks along the first dimension
+    resolutions : list of float
+        the levels of the time pyramid, none by default
+    dim : str
+        the time dimension
+
+    """
+    temporary = f'{path}.tmp'
+    shutil.rmtree(temporary, ignore_errors=True)
+    groups = [
+        (f'{experiment}/{statistic}', dataset)
+        for statistic, datasets in (('mean', means), ('std', stdevs))
+        for experiment, dataset in datasets.items()
+    ]
+    for experiment, dataset in means.items():
+        if dim in dataset.dims:
+            groups += [(pyramidGroup(experiment, resolution), level) for resolution, level in timePyramid(dataset, resolutions, dim).items()]
+    for group, dataset in groups:
+        stacked = {name: list(index.names) for name, index in dataset.indexes.items() if name in dataset.dims and index.nlevels > 1}
+        if stacked:
+            dataset = dataset.reset_index(list(stacked)).assign_attrs(stacked=json.dumps(stacked))
+        encoding = {
+            name: {'chunks': (-(-variable.shape[0] // chunks), *variable.shape[1:])}
+            for name, variable in dataset.data_vars.items() if variable.ndim and variable.size
+        }
+        dataset.to_zarr(temporary, group=group, mode='w', encoding=encoding)
+    # Directories cannot be replaced: move the old store aside, so that it is deleted only once the new one is in place
+    previous = f'{path}.old'
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, previous)
+    os.replace(temporary, path)
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+def updateSummary(path, experiment, mean, stdev, resolutions=(), dim='time'):
+    """
+    Merges the mean and standard deviation of part of an experiment into the summary written by saveSummary, in place:
+    only the bounding box of the updated coordinates is read and rewritten, the rest of the summary is left untouched.
+    The buckets of the time pyramid depend on a single series each, so the levels are updated from the slice as well.
+
+    Parameters
+    ----------
+    path : str
+        the Zarr store
+    experiment : str
+        the experiment the datasets belong to
+    mean, stdev : xr.Dataset
+        the updated slice, with the same layout, variables and timeline as the summary
+    resolutions : list of float
+        the levels of the time pyramid in the summary
+    dim : str
+        the time dimension
+
+    Returns
+    -------
+    bool
+        False, without writing anything, if the slice does not fit in the summary (e.g., it has new coordinate values),
+        in which case the whole summary must be saved again
+
+    """
+    import pandas as pd
+    levels = timePyramid(mean, resolutions, dim)
+    groups = [(f'{experiment}/mean', mean), (f'{experiment}/std', stdev)]
+    groups += [(pyramidGroup(experiment, resolution), level) for resolution, level in levels.items()]
+    try:
+        stored = xr.open_dataset(path, engine='zarr', group=f'{experiment}/mean', chunks=None)
+        storedLevels = {group: xr.open_dataset(path, engine='zarr', group=group, chunks=None) for group, _ in groups[2:]}
+    except (OSError, KeyError, ValueError):
+        return False
+    if any(level.sizes[dim] != levels[resolution].sizes[dim] for resolution, level in zip(levels, storedLevels.values())):
+        return False
+    stacked = json.loads(stored.attrs.get('stacked', '{}'))
+    storedDims = {name: variable.dims for name, variable in stored.data_vars.items()}
+    if storedDims != {name: variable.dims for name, variable in mean.data_vars.items()}:
+        return False
+    # Map each updated coordinate value to its position in the summary, the time must match entirely
+    positions = {}
+    for coordinate in mean.dims:
+        if coordinate in stacked:
+            storedIndex = pd.MultiIndex.from_arrays([stored[level].values for level in stacked[coordinate]])
+            updated = mean.indexes[coordinate].reorder_levels(stacked[coordinate])
+        elif coordinate in stored.coords:
+            storedIndex, updated = stored.indexes[coordinate], mean.indexes[coordinate]
+        else:
+            return False
+        lookup = {value: idx for idx, value in enumerate(storedIndex)}
+        found = [lookup.get(value) for value in updated]
+        if None in found:
+            return False
+        positions[coordinate] = np.asarray(found)
+    # Rewrite the bounding box of the updated positions, which is all that is read
+    region = {dim: slice(found.min(), found.max() + 1) for dim, found in positions.items()}
+    local = {dim: found - found.min() for dim, found in positions.items()}
+    for group, dataset in groups:
+        groupRegion, groupLocal = dict(region), dict(local)
+        if group in storedLevels:
+            # The levels of the updated series are rewritten along all of their buckets
+            for name in (dim, 'statistic'):
+                groupRegion[name], groupLocal[name] = slice(0, dataset.sizes[name]), np.arange(dataset.sizes[name])
+        target = xr.open_dataset(path, engine='zarr', group=group, chunks=None)
+        target = target.drop_vars(list(target.coords)).isel(groupRegion).load()
+        target.attrs = {}
+        for name, variable in dataset.data_vars.items():
+            target[name].values[np.ix_(*(groupLocal[dim] for dim in variable.dims))] = variable.values
+        target.to_zarr(path, group=group, mode='r+', region=groupRegion)
+    return True
+
+
+def _restoreStacked(dataset):
+    stacked = json.loads(dataset.attrs.pop('stacked', '{}'))
+    return dataset.set_index(stacked) if stacked else dataset
+
+
+def loadSummary(path, experiments):
+    """
+    Opens lazily the summary written by saveSummary: variables are read only when accessed.
+
+    Parameters
+    ----------
+    path : str
+        the Zarr store
+    experiments : list of str
+        the experiments to open
+
+    Returns
+    -------
+    tuple of dict
+        The mean and standard deviation datasets of the experiments found in the store
+
+    """
+    means = {}
+    stdevs = {}
+    for experiment in experiments:
+        try:
+            mean = xr.open_dataset(path, engine='zarr', group=f'{experiment}/mean', chunks=None)
+            stdev = xr.open_dataset(path, engine='zarr', group=f'{experiment}/std', chunks=None)
+        except (OSError, KeyError, ValueError):
+            continue
+        means[experiment] = _restoreStacked(mean)
+        stdevs[experiment] = _restoreStacked(stdev)
+    return means, stdevs
+
+
+def loadPyramid(path, experiment, resolutions):
+    """
+    Opens lazily the levels of the time pyramid of an experiment written by saveSummary (see timePyramid).
+
+    Parameters
+    ----------
+    path : str
+        the Zarr store
+    experiment : str
+        the experiment to open
+    resolutions : list of float
+        the levels to open
+
+    Returns
+    -------
+    dict
+        Resolution to the Dataset of the level, for the levels found in the store
+
+    """
+    levels = {}
+    for resolution in resolutions:
+        try:
+            levels[resolution] = _restoreStacked(xr.open_dataset(path, engine='zarr', group=pyramidGroup(experiment, resolution), chunks=None))
+        except (OSError, KeyError, ValueError):
+            continue
+    return levels
+
+
+def windowDelta(data, window, dim='time'):
+    """
+    Computes the increment of a cumulative metric over a sliding window, x[t] - x[t - window],
+    with a single shift. Every other dimension is an independent series, so windows never
+    span across different experiments.
+
+    Parameters
+    ----------
+    data : xr.DataArray or xr.Dataset
+        the metrics to differentiate
+    window : int
+        the window length, in samples
+    dim : str
+        the dimension to slide along
+
+    Returns
+    -------
+    xr.DataArray or xr.Dataset
+        The windowed deltas, NaN for the first window samples
+
+    """
+    return data - data.shift({dim: window})
+
+
+def summaryStatistics(frame, by, confidence=0.95):
+    """
+    Computes the statistics drawn by the charts for every column of frame in a single groupby, keeping the index
+    levels in by and aggregating the others: mean, standard deviation, number of non-NaN values, minimum, maximum,
+    and the bounds of the confidence interval of the mean (normal approximation).
+    Groups keep the order in which they appear in frame, as seaborn does for categories.
+
+    Parameters
+    ----------
+    frame : pd.DataFrame
+        one column per metric, indexed by the coordinates
+    by : list of str
+        the index levels to group by
+    confidence : float
+        the level of the confidence interval
 
     Returns
     -------
-    list of list
-        A matrix with the values of the csv file
+    pd.DataFrame
+        A tidy table indexed by metric and by, with columns mean, sd, n, min, max, ciLow and ciHigh
+
+    """
+    import pandas as pd
+    from statistics import NormalDist
+    grouped = frame.groupby(level=list(by), sort=False).agg(['mean', 'std', 'count', 'min', 'max'])
+    table = pd.concat({name: grouped[name] for name in frame.columns}, names=['metric'])
+    table = table.rename(columns={'std': 'sd', 'count': 'n'})
+    margin = NormalDist().inv_cdf((1 + confidence) / 2) * table['sd'] / np.sqrt(table['n'])
+    return table.assign(ciLow=table['mean'] - margin, ciHigh=table['mean'] + margin)
 
+
+class Metric(collections.namedtuple('Metric', ['reduction', 'variables', 'formula'])):
+    """
+    Declaration of a metric derived from the exported variables.
+
+    Attributes
+    ----------
+    reduction : str
+        name of the reduction applied to the variables before the formula (see DerivedMetrics)
+    variables : list of str
+        the exported variables the formula reads
+    formula : function
+        maps the reduced Dataset to the metric DataArray
     """
-    regex = re.compile(r'\d')
-    with open(path, 'r') as file:
-        lines = filter(lambda x: regex.match(x[0]), file.readlines())
-        return [[float(x) for x in line.split()] for line in lines]
+    __slots__ = ()
+
+
+class DerivedMetrics:
+    """
+    Computes derived metrics on demand, sharing the work among them: each reduction is computed once,
+    on all the variables read by the metrics using it, and each metric is computed once.
+
+    Parameters
+    ----------
+    dataset : xr.Dataset
+        the source data
+    metrics : dict
+        metric name to Metric
+    reductions : dict
+        reduction name to a function mapping a Dataset to its reduced version
+    """
+
+    def __init__(self, dataset, metrics, reductions):
+        self.dataset = dataset
+        self.metrics = metrics
+        self.reductions = reductions
+        self.plan = collections.defaultdict(list)
+        for metric in metrics.values():
+            self.plan[metric.reduction] += [v for v in metric.variables if v not in self.plan[metric.reduction]]
+        self.reduced = {}
+        self.computed = {}
+        self.frames = {}
+        self.summaries = {}
+
+    def reduce(self, reduction):
+        if reduction not in self.reduced:
+            with instrumentation.stage('reduction', reduction):
+                self.reduced[reduction] = self.reductions[reduction](self.dataset[self.plan[reduction]]).compute()
+        return self.reduced[reduction]
+
+    def __getitem__(self, name):
+        if name not in self.computed:
+            metric = self.metrics[name]
+            reduced = self.reduce(metric.reduction)
+            with instrumentation.stage('metric', name):
+                self.computed[name] = metric.formula(reduced).rename(name)
+        return self.computed[name]
+
+    def frame(self, name):
+        """
+        Returns a DataFrame with the metric as its only column, indexed by the coordinates.
+        All the metrics sharing a reduction are converted to a single DataFrame, once.
+        """
+        reduction = self.metrics[name].reduction
+        if reduction not in self.frames:
+            names = [other for other, metric in self.metrics.items() if metric.reduction == reduction]
+            self.frames[reduction] = xr.Dataset({other: self[other] for other in names}).to_dataframe()
+        return self.frames[reduction][[name]]
+
+    def statistics(self, name, by):
+        """
+        Returns the statistics of the metric grouped by the coordinates in by, see summaryStatistics.
+        All the metrics sharing a reduction are summarized together, once.
+        """
+        reduction = self.metrics[name].reduction
+        key = (reduction, tuple(by))
+        if key not in self.summaries:
+            self.frame(name)
+            with instrumentation.stage('statistics', reduction):
+                self.summaries[key] = summaryStatistics(self.frames[reduction], by)
+        return self.summaries[key].loc[name]
+
+    def table(self):
+        """
+        Returns the statistics computed so far as a single tidy DataFrame, one row per metric and group.
+        """
+        import pandas as pd
+        return pd.concat([summary.reset_index() for summary in self.summaries.values()], ignore_index=True)
 
 
 def beautifyValue(v):
@@ -188,24 +1456,314 @@ def beautifyValue(v):
         return v
 
 
+class ChartJob(collections.namedtuple('ChartJob', ['name', 'render', 'data', 'options', 'formats'])):
+    """
+    A self-contained chart, that can be rendered in any process.
+
+    Attributes
+    ----------
+    name : str
+        file name of the chart, without extension
+    render : function
+        module-level function called as render(data, **options), returning a figure (or a seaborn Plotter)
+    data : object
+        the data to plot, must be picklable
+    options : dict
+        further arguments for render
+    formats : tuple of str
+        the formats to save the chart in
+    """
+    __slots__ = ()
+
+
+chartStyle = {
+    'matplotlib': {
+        'axes.titlesize': 12,
+        'axes.labelsize': 10,
+        'text.latex.preamble': r'\usepackage{amsmath,amssymb,amsfonts,amssymb,graphicx}',
+        "text.usetex": True,
+    },
+    'seaborn': 'whitegrid',
+    'theme': {
+        'font.size': 10,
+        'axes.titlesize': 18,
+        'axes.labelsize': 16,
+        'legend.fontsize': 16,
+    },
+}
+
+
+def setupChartStyle():
+    """
+    Configures matplotlib and seaborn for rendering the charts off-screen, according to chartStyle.
+    Must run in every rendering process.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import seaborn.objects as so
+    from seaborn import axes_style
+
+    matplotlib.rcParams.update(chartStyle['matplotlib'])
+    # sns.set(font_scale=2)
+    so.Plot.config.theme.update(axes_style(chartStyle['seaborn']))
+    so.Plot.config.theme.update(chartStyle['theme'])
+
+
+def make_line_chart(
+        xdata,
+        ydata,
+        title=None,
+        ylabel=None,
+        xlabel=None,
+        colors=None,
+        linewidth=1,
+        error_alpha=0.2,
+        figure_size=(6, 4)
+):
+    import matplotlib.pyplot as plt
+    fig = plt.figure(figsize=figure_size)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    #        ax.set_ylim(0)
+    #        ax.set_xlim(min(xdata), max(xdata))
+    index = 0
+    for (label, (data, error)) in ydata.items():
+        #            print(f'plotting {data}\nagainst {xdata}')
+        lines = ax.plot(xdata, data, label=label, color=colors(index / (len(ydata) - 1)) if colors else None,
+                        linewidth=linewidth)
+        index += 1
+        if error is not None:
+            last_color = lines[-1].get_color()
+            ax.fill_between(
+                xdata,
+                data + error,
+                data - error,
+                facecolor=last_color,
+                alpha=error_alpha,
+            )
+    return (fig, ax)
+
+
+def timeSeriesChart(data, title, xlabel, ylabel, xlim):
+    """
+    Renders one chart of the generate_all_charts grid: data is a pair (xdata, ydata) as in make_line_chart.
+    """
+    xdata, ydata = data
+    fig, ax = make_line_chart(title=title, xdata=xdata, xlabel=xlabel, ylabel=ylabel, ydata=ydata)
+    ax.set_xlim(*xlim)
+    ax.legend()
+    fig.tight_layout()
+    return fig
+
+
+def barChart(data, ylabel):
+    """
+    Bar chart of the mean by Thresholds and SwapPolicy, with standard deviation error bars.
+    data is a statistics table, see summaryStatistics.
+    """
+    import seaborn.objects as so
+    data = data.assign(low=data['mean'] - data['sd'], high=data['mean'] + data['sd'])
+    return (
+        so.Plot(data, x='Thresholds', y='mean', color='SwapPolicy')
+        .add(so.Bar(), so.Dodge())
+        .add(so.Range(), so.Dodge(), ymin='low', ymax='high')
+        .layout(engine='tight')
+        .scale(color='viridis')
+        .label(y=ylabel)
+        .plot()
+    )
+
+
+def lineChart(data, ylabel):
+    """
+    Line chart of the mean over time by Thresholds, with one facet per SwapPolicy and a band spanning the range.
+    data is a statistics table, see summaryStatistics.
+    """
+    import seaborn.objects as so
+    return (
+        so.Plot(data, x='time', y='mean', color='Thresholds')
+        .add(so.Line())
+        .add(so.Band(), ymin='min', ymax='max')
+        .facet("SwapPolicy")
+        .layout(engine='tight', size=(20, 4))
+        .scale(color='viridis')
+        .label(
+            x="Time (s)",
+            y=ylabel,
+            title="Sensor Allocation = {}".format
+        )
+        .plot()
+    )
+
+
+def renderChart(job, directory):
+    """
+    Renders a ChartJob, writing each format atomically in directory.
+
+    Returns
+    -------
+    list of str
+        The paths of the written files
+    """
+    import matplotlib.pyplot as plt
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    with instrumentation.stage('chart', job.name):
+        figure = job.render(job.data, **job.options)
+        paths = []
+        for extension in job.formats:
+            path = f'{directory}/{job.name}.{extension}'
+            if hasattr(figure, 'savefig'):
+                figure.savefig(f'{path}.tmp', format=extension, bbox_inches='tight')
+            else:
+                figure.save(f'{path}.tmp', format=extension, bbox_inches='tight')
+            os.replace(f'{path}.tmp', path)
+            paths.append(path)
+        plt.close(getattr(figure, '_figure', figure))
+    return paths
+
+
+def renderingCode(function):
+    """
+    Returns the source of function and of the functions of its module that it calls, directly or not, by name.
+    """
+    sources, pending, seen = [], [function], set()
+    while pending:
+        function = pending.pop()
+        if function in seen:
+            continue
+        seen.add(function)
+        try:
+            sources.append(inspect.getsource(function))
+        except (OSError, TypeError):
+            sources.append(function.__qualname__)
+        codes, names = [getattr(function, '__code__', None)], set()
+        while codes:
+            code = codes.pop()
+            if code is not None:
+                names.update(code.co_names)
+                codes += [constant for constant in code.co_consts if inspect.iscode(constant)]
+        pending += [
+            value for value in (getattr(function, '__globals__', {}).get(name) for name in sorted(names))
+            if inspect.isfunction(value) and value.__module__ == function.__module__
+        ]
+    return sources
+
+
+def chartKey(job):
+    """
+    Computes a content hash of a ChartJob: its data, its options, chartStyle,
+    and the code of renderChart, of its render function and of the chart helpers they call.
+    Charts with the same key produce the same output.
+    """
+    digest = hashlib.blake2b()
+    code = renderingCode(renderChart) + renderingCode(job.render)
+    digest.update(pickle.dumps((job.name, code, job.options, job.formats, chartStyle), protocol=4))
+    if hasattr(job.data, 'columns'):
+        import pandas as pd
+        digest.update(pickle.dumps((list(job.data.columns), list(job.data.index.names)), protocol=4))
+        digest.update(pd.util.hash_pandas_object(job.data, index=True).values.tobytes())
+    else:
+        digest.update(pickle.dumps(job.data, protocol=4))
+    return digest.hexdigest()
+
+
+def renderCharts(jobs, directory, workers=None):
+    """
+    Renders the charts on a process pool, each process using the Agg backend.
+    Charts whose key (see chartKey) matches the one recorded in the manifest of directory,
+    and whose files still exist, are skipped.
+
+    Parameters
+    ----------
+    jobs : list of ChartJob
+        the charts to render
+    directory : str
+        where to save the charts
+    workers : int, optional
+        size of the process pool: None uses every available core, 1 renders in the current process
+
+    Returns
+    -------
+    list of str
+        The paths of the written files
+
+    """
+    manifestPath = Path(directory) / 'manifest.json'
+    try:
+        manifest = json.loads(manifestPath.read_text())
+    except (OSError, ValueError):
+        manifest = {}
+    keys = {job.name: chartKey(job) for job in jobs}
+    jobs = [
+        job for job in jobs
+        if manifest.get(job.name, {}).get('key') != keys[job.name]
+        or not all(os.path.exists(path) for path in manifest[job.name]['files'])
+    ]
+    render = functools.partial(renderChart, directory=directory)
+    if workers == 1 or len(jobs) <= 1:
+        if jobs:
+            setupChartStyle()
+        results = list(map(render, jobs))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=setupChartStyle) as executor:
+            results = list(instrumentedMap(executor, render, jobs))
+    if jobs:
+        for job, paths in zip(jobs, results):
+            manifest[job.name] = {'key': keys[job.name], 'files': paths}
+        temporary = manifestPath.with_name(f'{manifestPath.name}.tmp')
+        temporary.write_text(json.dumps(manifest, indent=2, sort_keys=True) + '\n')
+        os.replace(temporary, manifestPath)
+    print(f'{len(jobs)} charts rendered, {len(keys) - len(jobs)} unchanged in {directory}')
+    return [path for paths in results for path in paths]
+
+
 if __name__ == '__main__':
     # CONFIGURE SCRIPT
     # Where to find Alchemist data files
     directory = 'data'
     # Where to save charts
     output_directory = 'charts'
-    # How to name the summary of the processed data
-    pickleOutput = 'data_summary'
+    # Where to store the summary of the processed data
+    summaryOutput = 'data_summary.zarr'
+    # Where to store the statistics drawn by the custom charts
+    statisticsOutput = f'{output_directory}/custom/statistics.csv'
+    # Where to cache the resampled data files
+    cacheDirectory = '.process_cache'
+    # Check the coordinates in the names of new data files against their headers
+    verifyFileNames = True
+    # Where to write the timings of the stages of the last run
+    reportOutput = 'process_report.json'
+    # Profile each stage: None, 'cprofile' or 'tracemalloc', dumping the profiles in profileDirectory
+    profile = None
+    profileDirectory = 'profiles'
     # Experiment prefixes: one per experiment (root of the file name)
     experiments = ['dynamic']
     floatPrecision = '{: 0.3f}'
     # time management
     minTime = 0
     maxTime = int(16 * 3600) - minTime
+    # Columns to load from the data files, None loads all of them
+    columns = None
     # Number of time samples
     timeSamples = int((maxTime - minTime) / 60)
     timeColumnName = 'time'
     logarithmicTime = False
+    # Coarser levels of the summary, as bucket widths in seconds: the coarsest answers the maxima and sums over time
+    timeResolutions = [600, 3600]
+    # Level the time series of the charts are drawn from, None draws every sample of the timeline
+    chartResolution = None
+    # How to resample each run on the timeline: 'nearest' or 'linear'
+    resampling = 'nearest'
+    # Processes used to ingest the data files, None uses every available core
+    workers = None
+    # Store the data as float32 on a memory-mapped file, for sweeps that do not fit in memory
+    lowMemory = False
+    # Store only the observed combinations of the coordinates, along a stacked 'run' dimension, rather than their grid
+    sparse = False
+    # Also render the full grid of line charts of generate_all_charts (slow)
+    allCharts = False
     # One or more variables are considered random and "flattened"
     # seedVars = ['Seed']
     seedVars = []
@@ -292,141 +1850,307 @@ if __name__ == '__main__':
 
 
     # Setup libraries
-    np.set_printoptions(formatter={'float': floatPrecision.format})
-    # Read the last time the data was processed, reprocess only if new data exists, otherwise just load
-    import pickle
-    import os
-
-    if os.path.exists(directory):
-        newestFileTime = max([os.path.getmtime(directory + '/' + file) for file in os.listdir(directory)], default=0.0)
+    fileIndex = FileIndex(directory, f'{cacheDirectory}/files', verifyFileNames)
+
+
+    def discoverFiles(experiment, **coordinates):
+        """
+        Returns the sorted paths of the data files of an experiment, only those with the given coordinates if any
+        (see FileIndex.select).
+        """
+        with instrumentation.stage('discover', experiment):
+            fileIndex.refresh()
+            return fileIndex.select(experiment, **coordinates)
+
+
+    def experimentDimensions(allfiles):
+        """
+        Returns the coordinates of an experiment, mapped to their sorted values.
+        """
+        dimensions = {}
+        for file in allfiles:
+            dimensions = mergeDicts(dimensions, fileIndex.coordinates(file))
+        return {k: sorted(v) for k, v in dimensions.items()}
+
+
+    def variableNames(file):
+        """
+        Returns the names of the columns to load from the data files, following the one of file.
+        """
+        varNames = extractVariableNames(file)
+        if columns is not None:
+            varNames = [v for v in varNames if v == timeColumnName or v in columns]
+        return varNames
+
+
+    @contextlib.contextmanager
+    def builderBacking():
+        """
+        Yields the function mapping an experiment to the backing of its DatasetBuilder: in low memory mode,
+        a prefix in a temporary directory of cacheDirectory, deleted with the arrays once the summary holds them.
+        """
+        if not lowMemory:
+            yield lambda experiment: None
+            return
+        os.makedirs(cacheDirectory, exist_ok=True)
+        scratch = tempfile.mkdtemp(prefix='build-', dir=cacheDirectory)
         try:
-            lastTimeProcessed = pickle.load(open('timeprocessed', 'rb'))
-        except:
-            lastTimeProcessed = -1
-        shouldRecompute = not os.path.exists(".skip_data_process") and newestFileTime != lastTimeProcessed
-        if not shouldRecompute:
-            try:
-                means = pickle.load(open(pickleOutput + '_mean', 'rb'))
-                stdevs = pickle.load(open(pickleOutput + '_std', 'rb'))
-            except:
-                shouldRecompute = True
-        if shouldRecompute:
-            timefun = np.logspace if logarithmicTime else np.linspace
+            yield lambda experiment: f'{scratch}/{experiment}'
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+    def processData(aggregate=True):
+        """
+        Parses and resamples the data files that are new or changed since the last run into the cache.
+        If aggregate, folds the seed variables of the experiments with changes and updates the summary.
+
+        Returns
+        -------
+        tuple of dict
+            The mean and standard deviation datasets of each experiment, or None if not aggregating
+        """
+        global minTime, maxTime
+        if not os.path.exists(directory):
+            return {experiment: xr.Dataset() for experiment in experiments}, {experiment: xr.Dataset() for experiment in experiments}
+        previousMeans, previousStdevs = loadSummary(summaryOutput, experiments) if aggregate else ({}, {})
+        if aggregate and os.path.exists(".skip_data_process") and previousMeans.keys() == set(experiments):
+            return previousMeans, previousStdevs
+        np.set_printoptions(formatter={'float': floatPrecision.format})
+        timefun = np.logspace if logarithmicTime else np.linspace
+        with builderBacking() as backing:
+            cache = ResampleCache(cacheDirectory)
+            evicted = cache.evict({directory + '/' + name for name in os.listdir(directory)})
             means = {}
             stdevs = {}
+            changed = bool(evicted) or previousMeans.keys() != set(experiments)
+            changed = changed or any(loadPyramid(summaryOutput, experiment, timeResolutions).keys() != set(timeResolutions) for experiment in previousMeans)
             for experiment in experiments:
                 # Collect all files for the experiment of interest
-                import fnmatch
-
-                allfiles = filter(lambda file: fnmatch.fnmatch(file, experiment + '_*.csv'), os.listdir(directory))
-                allfiles = [directory + '/' + name for name in allfiles]
-                allfiles.sort()
+                allfiles = discoverFiles(experiment)
                 # From the file name, extract the independent variables
-                dimensions = {}
-                for file in allfiles:
-                    dimensions = mergeDicts(dimensions, extractCoordinates(file))
-                dimensions = {k: sorted(v) for k, v in dimensions.items()}
-                # Add time to the independent variables
-                dimensions[timeColumnName] = range(0, timeSamples)
-                # Compute the matrix shape
-                shape = tuple(len(v) for k, v in dimensions.items())
-                # Prepare the Dataset
-                dataset = xr.Dataset()
-                for k, v in dimensions.items():
-                    dataset.coords[k] = v
+                dimensions = experimentDimensions(allfiles)
                 if len(allfiles) == 0:
                     print("WARNING: No data for experiment " + experiment)
+                    dataset = xr.Dataset()
+                    for k, v in {**dimensions, timeColumnName: range(0, timeSamples)}.items():
+                        dataset.coords[k] = v
                     means[experiment] = dataset
                     stdevs[experiment] = xr.Dataset()
-                else:
-                    varNames = extractVariableNames(allfiles[0])
-                    for v in varNames:
-                        if v != timeColumnName:
-                            novals = np.ndarray(shape)
-                            novals.fill(float('nan'))
-                            dataset[v] = (dimensions.keys(), novals)
-                    # Compute maximum and minimum time, create the resample
-                    timeColumn = varNames.index(timeColumnName)
-                    allData = {file: np.matrix(openCsv(file)) for file in allfiles}
-                    computeMin = minTime is None
-                    computeMax = maxTime is None
+                    continue
+                varNames = variableNames(allfiles[0])
+                # Compute maximum and minimum time, create the resample
+                timeColumn = varNames.index(timeColumnName)
+                computeMin = minTime is None
+                computeMax = maxTime is None
+                if computeMin or computeMax:
+                    allTimes = [openExport(file, [timeColumnName])[:, 0] for file in allfiles]
                     if computeMax:
-                        maxTime = float('-inf')
-                        for data in allData.values():
-                            maxTime = max(maxTime, data[-1, timeColumn])
+                        maxTime = max(times[-1] for times in allTimes)
                     if computeMin:
-                        minTime = float('inf')
-                        for data in allData.values():
-                            minTime = min(minTime, data[0, timeColumn])
-                    timeline = timefun(minTime, maxTime, timeSamples)
-                    # Resample
-                    for file in allData:
-                        #                    print(file)
-                        allData[file] = convert(timeColumn, timeline, allData[file])
-                    # Populate the dataset
-                    for file, data in allData.items():
-                        dataset[timeColumnName] = timeline
-                        for idx, v in enumerate(varNames):
-                            if v != timeColumnName:
-                                darray = dataset[v]
-                                experimentVars = extractCoordinates(file)
-                                darray.loc[experimentVars] = data[:, idx].A1
-                    # Fold the dataset along the seed variables, producing the mean and stdev datasets
-                    mergingVariables = [seed for seed in seedVars if seed in dataset.coords]
-                    means[experiment] = dataset.mean(dim=mergingVariables, skipna=True)
-                    stdevs[experiment] = dataset.std(dim=mergingVariables, skipna=True)
+                        minTime = min(times[0] for times in allTimes)
+                timeline = timefun(minTime, maxTime, timeSamples)
+                # Load and resample in parallel the files missing from the cache
+                settings = (tuple(varNames), resampling, hashlib.blake2b(timeline.tobytes()).hexdigest())
+                allData = [cache.get(file, settings) for file in allfiles]
+                missing = [idx for idx, data in enumerate(allData) if data is None]
+                if missing:
+                    print(f'Processing {len(missing)} new or changed files out of {len(allfiles)} for {experiment}')
+                ingested = ingestFiles([allfiles[idx] for idx in missing], varNames, timeColumn, timeline, resampling, workers)
+                if not aggregate:
+                    for idx, data in zip(missing, ingested):
+                        cache.put(allfiles[idx], settings, *data)
+                    continue
+                prefix = f'{directory}/{experiment}_'
+                # The previous summary is reusable if the files and the layout did not change
+                if sparse:
+                    layout = {'run': len({tuple(v for k, v in fileIndex.coordinates(file).items() if k not in seedVars) for file in allfiles})}
+                else:
+                    layout = {k: len(v) for k, v in dimensions.items() if k not in seedVars}
+                previousLayout = {k: n for k, n in previousMeans[experiment].sizes.items() if k != timeColumnName} if experiment in previousMeans else None
+                reusable = previousLayout == layout
+                if not missing and reusable and not any(f.startswith(prefix) for f in evicted):
+                    means[experiment] = previousMeans[experiment]
+                    stdevs[experiment] = previousStdevs[experiment]
+                    continue
+                changed = True
+                # Populate the dataset folding the seed variables, releasing each matrix as soon as it is stored
+                builder = DatasetBuilder(
+                    dimensions,
+                    varNames,
+                    timeline,
+                    timeColumnName,
+                    seedVars,
+                    dtype=np.float32 if lowMemory else np.float64,
+                    backing=backing(experiment),
+                    runs=[fileIndex.coordinates(file) for file in allfiles] if sparse else None,
+                )
+                for idx, file in enumerate(allfiles):
+                    data = allData[idx]
+                    if data is None:
+                        data = next(ingested)
+                        cache.put(file, settings, *data)
+                    allData[idx] = None
+                    with instrumentation.stage('populate', file):
+                        builder.add(*data)
+                with instrumentation.stage('aggregate', experiment):
+                    means[experiment], stdevs[experiment] = builder.build()
+            cache.save()
+            if not aggregate:
+                return None, None
             # Save the datasets
-            pickle.dump(means, open(pickleOutput + '_mean', 'wb'), protocol=-1)
-            pickle.dump(stdevs, open(pickleOutput + '_std', 'wb'), protocol=-1)
-            pickle.dump(newestFileTime, open('timeprocessed', 'wb'))
-    else:
-        means = {experiment: xr.Dataset() for experiment in experiments}
-        stdevs = {experiment: xr.Dataset() for experiment in experiments}
+            if changed:
+                with instrumentation.stage('save', summaryOutput):
+                    saveSummary(summaryOutput, means, stdevs, resolutions=timeResolutions, dim=timeColumnName)
+                # Reopen lazily: results reused from the previous summary pointed to the replaced store
+                means, stdevs = loadSummary(summaryOutput, experiments)
+            return means, stdevs
+
+
+    def reprocessData(where):
+        """
+        Parses and resamples again the data files with the given coordinates (see FileIndex.select), even if unchanged,
+        then aggregates the slice of the sweep they belong to and merges it into the summary in place (see updateSummary).
+        Runs processData instead if there is no summary, or if it cannot hold the slice (e.g., new coordinate values).
+
+        Returns
+        -------
+        tuple of dict
+            The mean and standard deviation datasets of each experiment
+        """
+        means, stdevs = loadSummary(summaryOutput, experiments)
+        if means.keys() != set(experiments):
+            return processData()
+        cache = ResampleCache(cacheDirectory)
+        with builderBacking() as backing:
+            for experiment in experiments:
+                selected = discoverFiles(experiment, **where)
+                if not selected:
+                    continue
+                # The cells of the selected files fold the seeds of other files too
+                cells = {k: v for k, v in experimentDimensions(selected).items() if k not in seedVars}
+                allfiles = discoverFiles(experiment, **cells)
+                if sparse:
+                    runs = {tuple(fileIndex.coordinates(file).get(k) for k in cells) for file in selected}
+                    allfiles = [file for file in allfiles if tuple(fileIndex.coordinates(file).get(k) for k in cells) in runs]
+                varNames = variableNames(allfiles[0])
+                timeColumn = varNames.index(timeColumnName)
+                timeline = means[experiment][timeColumnName].values
+                settings = (tuple(varNames), resampling, hashlib.blake2b(timeline.tobytes()).hexdigest())
+                chosen = set(selected)
+                allData = [None if file in chosen else cache.get(file, settings) for file in allfiles]
+                missing = [idx for idx, data in enumerate(allData) if data is None]
+                print(f'Reprocessing {len(selected)} files of {experiment}, aggregating them with {len(allfiles) - len(selected)} more')
+                ingested = ingestFiles([allfiles[idx] for idx in missing], varNames, timeColumn, timeline, resampling, workers)
+                for idx, data in zip(missing, ingested):
+                    cache.put(allfiles[idx], settings, *data)
+                    allData[idx] = data
+                builder = DatasetBuilder(
+                    experimentDimensions(allfiles),
+                    varNames,
+                    timeline,
+                    timeColumnName,
+                    seedVars,
+                    dtype=np.float32 if lowMemory else np.float64,
+                    backing=backing(experiment),
+                    runs=[fileIndex.coordinates(file) for file in allfiles] if sparse else None,
+                )
+                for data in allData:
+                    builder.add(*data)
+                mean, stdev = builder.build()
+                with instrumentation.stage('save', summaryOutput):
+                    updated = updateSummary(summaryOutput, experiment, mean, stdev, timeResolutions, timeColumnName)
+                if not updated:
+                    print(f'The summary of {experiment} cannot hold the reprocessed slice, updating it all')
+                    cache.save()
+                    return processData()
+        cache.save()
+        return loadSummary(summaryOutput, experiments)
+
+
+    def loadPyramids():
+        """
+        Opens lazily the levels of the time pyramids of the experiments in the summary, see loadPyramid.
+        """
+        return {experiment: loadPyramid(summaryOutput, experiment, timeResolutions) for experiment in experiments}
+
+
+    def watchData(names, interval):
+        """
+        Follows the data files while the simulations write them, parsing only the appended rows,
+        and redraws the charts names every interval seconds if new samples are complete. Runs until interrupted.
+        """
+        timeline = (np.logspace if logarithmicTime else np.linspace)(minTime, maxTime, timeSamples)
+        followers = {experiment: {} for experiment in experiments}
+        builders = {}
+        means = {}
+        try:
+            while True:
+                updated = False
+                for experiment in experiments:
+                    # Files replaced by a binary export are not followed anymore
+                    followers[experiment] = {
+                        file: followers[experiment].get(file) or TailFollower(file, timeColumnName, timeline, resampling, columns)
+                        for file in discoverFiles(experiment)
+                    }
+                    updates = [(follower, follower.poll()) for follower in followers[experiment].values()]
+                    started = [follower for follower in followers[experiment].values() if follower.columns is not None]
+                    if not started:
+                        continue
+                    dimensions = {}
+                    for follower in started:
+                        dimensions = mergeDicts(dimensions, follower.coordinates)
+                    dimensions = {k: sorted(v) for k, v in dimensions.items()}
+                    # New coordinates reshape the arrays, truncated files invalidate what they contributed: start over
+                    key = (repr(dimensions), tuple((follower.path, follower.resets) for follower in started))
+                    changed = False
+                    if experiment not in builders or builders[experiment][0] != key:
+                        runs = [follower.coordinates for follower in started] if sparse else None
+                        builder = DatasetBuilder(dimensions, started[0].columns, timeline, timeColumnName, seedVars, runs=runs)
+                        for follower in started:
+                            builder.add(follower.coordinates, follower.resampled[:follower.ready])
+                        builders[experiment] = (key, builder)
+                        changed = True
+                    else:
+                        builder = builders[experiment][1]
+                        for follower, update in updates:
+                            if update is not None:
+                                builder.add(follower.coordinates, follower.resampled[update], start=update.start)
+                                changed = True
+                    if changed:
+                        means[experiment] = builder.build()[0]
+                        updated = True
+                if updated and means.keys() == set(experiments):
+                    allFollowers = [follower for experiment in experiments for follower in followers[experiment].values()]
+                    complete = sum(follower.ready for follower in allFollowers) / (len(allFollowers) * timeSamples)
+                    finished = sum(follower.finished for follower in allFollowers)
+                    print(f'{len(allFollowers)} files, {finished} finished, {complete:.1%} of the samples')
+                    renderCustomCharts(means, names)
+                # Polls record runs at every refresh: keep their totals only
+                instrumentation.fold()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+
+    def listExperiments(coordinates):
+        """
+        Prints the experiments found in the data directory, with their coordinates, and the available charts.
+        If coordinates are given, only the matching files are considered, and they are listed.
+        Only the file index is read.
+        """
+        for experiment in experiments:
+            allfiles = discoverFiles(experiment, **coordinates)
+            print(f'{experiment}: {len(allfiles)} files')
+            for k, v in experimentDimensions(allfiles).items():
+                print(f'    {k}: {", ".join(str(beautifyValue(value)) for value in v)}')
+            if coordinates:
+                for file in allfiles:
+                    print(f'    {file}')
+        print(f'charts: {", ".join(customCharts)}')
 
-    # QUICK CHARTING
 
-    import matplotlib
-    import matplotlib.pyplot as plt
-    import matplotlib.cm as cmx
-
-    matplotlib.rcParams.update({'axes.titlesize': 12})
-    matplotlib.rcParams.update({'axes.labelsize': 10})
-
-
-    def make_line_chart(
-            xdata,
-            ydata,
-            title=None,
-            ylabel=None,
-            xlabel=None,
-            colors=None,
-            linewidth=1,
-            error_alpha=0.2,
-            figure_size=(6, 4)
-    ):
-        fig = plt.figure(figsize=figure_size)
-        ax = fig.add_subplot(1, 1, 1)
-        ax.set_title(title)
-        ax.set_xlabel(xlabel)
-        ax.set_ylabel(ylabel)
-        #        ax.set_ylim(0)
-        #        ax.set_xlim(min(xdata), max(xdata))
-        index = 0
-        for (label, (data, error)) in ydata.items():
-            #            print(f'plotting {data}\nagainst {xdata}')
-            lines = ax.plot(xdata, data, label=label, color=colors(index / (len(ydata) - 1)) if colors else None,
-                            linewidth=linewidth)
-            index += 1
-            if error is not None:
-                last_color = lines[-1].get_color()
-                ax.fill_between(
-                    xdata,
-                    data + error,
-                    data - error,
-                    facecolor=last_color,
-                    alpha=error_alpha,
-                )
-        return (fig, ax)
+    # QUICK CHARTING
 
 
     def generate_all_charts(means, errors=None, basedir=''):
@@ -442,261 +2166,336 @@ if __name__ == '__main__':
                     for current_metric in merge_data_view.data_vars:
                         title = f'{label_for(current_metric)} for diverse {label_for(comparison_variable)} when {label_for(current_coordinate)}={beautified_value}'
                         for withErrors in [True, False]:
-                            fig, ax = make_line_chart(
-                                title=title,
-                                xdata=merge_data_view[timeColumnName],
-                                xlabel=unit_for(timeColumnName),
-                                ylabel=unit_for(current_metric),
-                                ydata={
-                                    beautifyValue(label): (
-                                        merge_data_view.sel(selector)[current_metric],
-                                        merge_error_view.sel(selector)[current_metric] if withErrors else 0
-                                    )
-                                    for label in merge_data_view[comparison_variable].values
-                                    for selector in
-                                    [{comparison_variable: label, current_coordinate: current_coordinate_value}]
-                                },
-                            )
-                            ax.set_xlim(minTime, maxTime)
-                            ax.legend()
-                            fig.tight_layout()
-                            by_time_output_directory = f'{output_directory}/{basedir}/{comparison_variable}'
-                            Path(by_time_output_directory).mkdir(parents=True, exist_ok=True)
+                            ydata = {
+                                beautifyValue(label): (
+                                    merge_data_view.sel(selector)[current_metric].values,
+                                    merge_error_view.sel(selector)[current_metric].values if withErrors else 0
+                                )
+                                for label in merge_data_view[comparison_variable].values
+                                for selector in
+                                [{comparison_variable: label, current_coordinate: current_coordinate_value}]
+                            }
                             figname = f'{comparison_variable}_{current_metric}_{current_coordinate}_{beautified_value}{"_err" if withErrors else ""}'
                             for symbol in r".[]\/@:":
                                 figname = figname.replace(symbol, '_')
-                            fig.savefig(f'{by_time_output_directory}/{figname}.pdf')
-                            plt.close(fig)
-
+                            yield f'{basedir}/{comparison_variable}', ChartJob(
+                                figname,
+                                timeSeriesChart,
+                                (merge_data_view[timeColumnName].values, ydata),
+                                {
+                                    'title': title,
+                                    'xlabel': unit_for(timeColumnName),
+                                    'ylabel': unit_for(current_metric),
+                                    'xlim': (minTime, maxTime),
+                                },
+                                ('pdf',),
+                            )
 
-    for experiment in experiments:
-        current_experiment_means = means[experiment]
-        current_experiment_errors = stdevs[experiment]
-        # generate_all_charts(current_experiment_means, current_experiment_errors, basedir = f'{experiment}/all')
 
-    # Custom charting
-    import math
-    import matplotlib.ticker as mticker
-    import seaborn as sns
-    import seaborn.objects as so
-    import pandas as pd
-    from seaborn import axes_style
+    def renderAllCharts(means, stdevs):
+        for experiment in experiments:
+            # The views of the grid of coordinates need the whole grid
+            current_experiment_means = means[experiment].unstack('run') if 'run' in means[experiment].dims else means[experiment]
+            current_experiment_errors = stdevs[experiment].unstack('run') if 'run' in stdevs[experiment].dims else stdevs[experiment]
+            chartsByDirectory = collections.defaultdict(list)
+            for basedir, job in generate_all_charts(current_experiment_means, current_experiment_errors, basedir=f'{experiment}/all'):
+                chartsByDirectory[basedir].append(job)
+            for basedir, jobs in chartsByDirectory.items():
+                renderCharts(jobs, f'{output_directory}/{basedir}', workers)
 
-    os.makedirs(f"{output_directory}/custom", exist_ok=True)
 
-    plt.rc('text.latex', preamble=r'\usepackage{amsmath,amssymb,amsfonts,amssymb,graphicx}')
-    plt.rcParams.update({"text.usetex": True})
-
-    # sns.set(font_scale=2)
-    so.Plot.config.theme.update(axes_style("whitegrid"))
-    so.Plot.config.theme["font.size"] = 10
-    so.Plot.config.theme["axes.titlesize"] = 18
-    so.Plot.config.theme["axes.labelsize"] = 16
-    so.Plot.config.theme["legend.fontsize"] = 16
-    # setup viridis seaborn
-
-    thresholds = [r'$\Updownarrow_{0}$', r'$\Updownarrow_{10}$', r'$\Updownarrow_{100}$', r'$\Updownarrow_{20}$', r'$\Updownarrow_{30}$', r'$\Updownarrow_{40}$']
+    # Custom charting
+    thresholds = {
+        '[0.0, 0.0]': r'$\Updownarrow_{0}$',
+        '[10.0, 100.0]': r'$\Updownarrow_{10}$',
+        '[20.0, 100.0]': r'$\Updownarrow_{20}$',
+        '[30.0, 100.0]': r'$\Updownarrow_{30}$',
+        '[40.0, 100.0]': r'$\Updownarrow_{40}$',
+        '[100.0, 100.0]': r'$\Updownarrow_{100}$',
+    }
     thresholds_ordered = [r'$\Updownarrow_{0}$', r'$\Updownarrow_{10}$', r'$\Updownarrow_{20}$', r'$\Updownarrow_{30}$', r'$\Updownarrow_{40}$', r'$\Updownarrow_{100}$']
     ordered_policies = ['smartphone', 'hybrid', 'wearable']
-
-    dynamic_dataset = means['dynamic']
-    dynamic_dataset.coords['Thresholds'] = thresholds
-    dynamic_dataset = dynamic_dataset.reindex(Thresholds=thresholds_ordered)
-    dynamic_dataset = dynamic_dataset.reindex(SwapPolicy=ordered_policies)
-
     window_in_seconds = 1800  # 30 minutes window
-    travel_distance = dynamic_dataset['TraveledDistance[mean]'].to_dataframe()
-    travel_distance.rename({'TraveledDistance[mean]': 'TraveledDistance'}, axis=1, inplace=True)
-    rows_per_window = math.ceil(window_in_seconds / (dynamic_dataset['time'].diff(dim='time').mean()))
-    travel_distance = travel_distance.rolling(window=rows_per_window).apply(lambda x: x.iloc[-1] - x.iloc[0])
-
-    travel_plot = (
-        so.Plot(travel_distance, x='time', y='TraveledDistance', color='Thresholds')
-        .add(so.Line(), so.Agg())
-        .add(so.Band())
-        .facet("SwapPolicy")
-        .layout(engine='tight', size=(20, 4))
-        .scale(color='viridis')
-        .label(
-            x="Time (s)",
-            y="Traveled Distance (m)",
-            title="Sensor Allocation = {}".format
-        )
-        .plot()
-    )
-    travel_plot.save(f"{output_directory}/custom/travel_distance.pdf", bbox_inches="tight")
-    travel_plot.save(f"{output_directory}/custom/travel_distance.svg", bbox_inches="tight")
-
-    max_traveled_distance = dynamic_dataset['TraveledDistance[mean]'].max(dim='time').to_dataframe()
-    max_traveled_distance.rename({'TraveledDistance[mean]': 'TraveledDistance'}, axis=1, inplace=True)
-    max_traveled_distance_plot = (
-        so.Plot(max_traveled_distance, x='Thresholds', y='TraveledDistance', color='SwapPolicy')
-        .add(so.Bar(), so.Agg(), so.Dodge())
-        .add(so.Range(), so.Est(errorbar="sd"), so.Dodge())
-        # .limit(y=(25000, None))
-        .layout(engine='tight')
-        .scale(color='viridis')
-        .label(y="Traveled Distance (m)")
-        .plot()
-    )
-    max_traveled_distance_plot.save(f"{output_directory}/custom/max_traveled_distance.pdf", bbox_inches="tight")
-    max_traveled_distance_plot.save(f"{output_directory}/custom/max_traveled_distance.svg", bbox_inches="tight")
+    # Charts by name, each function maps the derived metrics to a ChartJob
+    customCharts = {}
+    # Coordinates the statistics of each kind of chart are grouped by
+    barBy = ['Thresholds', 'SwapPolicy']
+    lineBy = ['Thresholds', 'SwapPolicy', 'time']
+
+
+    def customChart(function):
+        customCharts[function.__name__] = function
+        return function
+
+
+    def rows_per_window(dynamic_dataset):
+        import math
+        return math.ceil(window_in_seconds / (dynamic_dataset['time'].diff(dim='time').mean()))
+
+
+    def derivedMetrics():
+        hours = maxTime / 3600
+        return {
+            'TraveledDistance': Metric('window', ['TraveledDistance[mean]'], lambda d: d['TraveledDistance[mean]']),
+            'MaxTraveledDistance': Metric('max', ['TraveledDistance[mean]'], lambda d: d['TraveledDistance[mean]']),
+            'CloudCost': Metric('max', ['CloudCost[sum]'], lambda d: d['CloudCost[sum]'] / hours),
+            'QoS': Metric(
+                'window',
+                ['TraveledDistance[mean]', 'CloudCost[sum]', 'WearableCharging[mean]', 'SmartphoneCharging[mean]'],
+                lambda d: d['TraveledDistance[mean]'] * (1 - d['SmartphoneCharging[mean]']) * (1 - d['WearableCharging[mean]']) / d['CloudCost[sum]'],
+            ),
+            'MaxQoS': Metric(
+                'max',
+                ['TraveledDistance[mean]', 'CloudCost[sum]'],
+                lambda d: d['TraveledDistance[mean]'] / d['CloudCost[sum]'],
+            ),
+            'Charging': Metric(
+                'none',
+                ['SmartphoneCharging[mean]', 'WearableCharging[mean]'],
+                lambda d: (1 - d['SmartphoneCharging[mean]']) * (1 - d['WearableCharging[mean]']),
+            ),
+            'PowerConsumption': Metric(
+                'sum',
+                ['SmartphonePower[mean]', 'WearablePower[mean]', 'CloudPower[mean]'],
+                lambda d: (d['SmartphonePower[mean]'] + d['WearablePower[mean]'] + d['CloudPower[mean]']) / hours,
+            ),
+            'ChargingTime': Metric('max', ['SmartphoneRechargeTime[mean]'], lambda d: d['SmartphoneRechargeTime[mean]'] / 60),
+            'Performance': Metric(
+                'max',
+                ['SmartphoneRechargeTime[mean]', 'CloudCost[sum]'],
+                lambda d: (1 - (d['SmartphoneRechargeTime[mean]'] / maxTime)) / d['CloudCost[sum]'],
+            ),
+        }
+
+
+    def metricReductions(dynamic_dataset, levels):
+        """
+        Maxima and sums over time are read from the coarsest level of the time pyramid (see timePyramid), if any,
+        time series from the chartResolution level, if any, or from dynamic_dataset.
+        """
+        def fromLevel(resolution, statistic, fallback):
+            if resolution not in levels:
+                return fallback
+            return lambda d: levels[resolution][list(d.data_vars)].sel(statistic=statistic, drop=True)
+
+        top = max(levels, default=None)
+        peaks = fromLevel(top, 'max', lambda d: d)
+        totals = fromLevel(top, 'sum', lambda d: d)
+        series = fromLevel(chartResolution, 'mean', lambda d: d)
+        cumulative = fromLevel(chartResolution, 'last', lambda d: d)
+        if chartResolution in levels:
+            # Buckets are chartResolution apart, but for the singleton last one
+            lag = round(window_in_seconds / chartResolution)
+        else:
+            # A window of rows_per_window samples spans rows_per_window - 1 steps
+            lag = rows_per_window(dynamic_dataset) - 1
+        return {
+            'none': series,
+            'max': lambda d: peaks(d).max(dim='time'),
+            'sum': lambda d: totals(d).sum(dim='time'),
+            'window': lambda d: windowDelta(cumulative(d), lag),
+        }
+
+
+    @customChart
+    def travel_distance(metrics):
+        return ChartJob('travel_distance', lineChart, metrics.statistics('TraveledDistance', lineBy), {
+            'ylabel': "Traveled Distance (m)",
+        }, ('pdf', 'svg'))
+
+
+    @customChart
+    def max_traveled_distance(metrics):
+        return ChartJob('max_traveled_distance', barChart, metrics.statistics('MaxTraveledDistance', barBy), {
+            'ylabel': "Traveled Distance (m)",
+        }, ('pdf', 'svg'))
     # End plot traveled distance ---------------------------------------------------------------------------------------
 
-    cloud_cost = dynamic_dataset['CloudCost[sum]']
-    cloud_cost = cloud_cost.max(dim='time').to_dataframe()
-    cloud_cost = cloud_cost / (maxTime / 3600)
-    cloud_cost.rename({'CloudCost[sum]': 'CloudCost'}, axis=1, inplace=True)
-    cloud_cost_plot = (
-        so.Plot(cloud_cost, x='Thresholds', y='CloudCost', color='SwapPolicy')
-        .add(so.Bar(), so.Agg(), so.Dodge())
-        .add(so.Range(), so.Est(errorbar="sd"), so.Dodge())
-        .layout(engine='tight')
-        .scale(color='viridis')
-        .label(y=r"$\$_{cloud} (\$/h)$")
-        .plot()
-    )
-    cloud_cost_plot.save(f"{output_directory}/custom/cloud_cost.pdf", bbox_inches="tight")
-    cloud_cost_plot.save(f"{output_directory}/custom/cloud_cost.svg", bbox_inches="tight")
+
+    @customChart
+    def cloud_cost(metrics):
+        return ChartJob('cloud_cost', barChart, metrics.statistics('CloudCost', barBy), {
+            'ylabel': r"$\$_{cloud} (\$/h)$",
+        }, ('pdf', 'svg'))
     # End plot cloud cost ----------------------------------------------------------------------------------------------
 
-    qos = dynamic_dataset[['TraveledDistance[mean]', 'CloudCost[sum]', 'WearableCharging[mean]', 'SmartphoneCharging[mean]']]
-    qos = qos.to_dataframe()
-    traveled_window = qos['TraveledDistance[mean]'].rolling(window=rows_per_window).apply(lambda x: x.iloc[-1] - x.iloc[0])
-    cost_window = qos['CloudCost[sum]'].rolling(window=rows_per_window).apply(lambda x: x.iloc[-1] - x.iloc[0])
-    smartphone_charging = qos['SmartphoneCharging[mean]'].rolling(window=rows_per_window).apply(lambda x: x.iloc[-1] - x.iloc[0])
-    wearable_charging = qos['WearableCharging[mean]'].rolling(window=rows_per_window).apply(lambda x: x.iloc[-1] - x.iloc[0])
-    qos['QoS'] = (traveled_window * (1 - smartphone_charging) * (1 - wearable_charging)) / cost_window
-    qos_plot = (
-        so.Plot(qos, x='time', y='QoS', color='Thresholds')
-        .add(so.Line(), so.Agg())
-        .add(so.Band())
-        .facet("SwapPolicy")
-        .layout(engine='tight', size=(20, 4))
-        .scale(color='viridis')
-        .label(
-            x="Time (s)",
-            y=r"QoS (m/\$)",
-            title="Sensor Allocation = {}".format
-        )
-        .plot()
-    )
-    qos_plot.save(f"{output_directory}/custom/qos.pdf", bbox_inches="tight")
-    qos_plot.save(f"{output_directory}/custom/qos.svg", bbox_inches="tight")
 
-    qos_max = dynamic_dataset.max(dim='time').to_dataframe()
-    qos_max['QoS'] = qos_max['TraveledDistance[mean]'] / qos_max['CloudCost[sum]']
+    @customChart
+    def qos(metrics):
+        return ChartJob('qos', lineChart, metrics.statistics('QoS', lineBy), {
+            'ylabel': r"QoS (m/\$)",
+        }, ('pdf', 'svg'))
 
-    qos_bar = (
-        so.Plot(qos_max, x='Thresholds', y='QoS', color='SwapPolicy')
-        .add(so.Bar(), so.Agg(), so.Dodge())
-        .add(so.Range(), so.Est(errorbar="sd"), so.Dodge())
-        .layout(engine='tight')
-        .scale(color='viridis')
-        .label(y=r"QoS (m/\$)")
-        .plot()
-    )
-    qos_bar.save(f"{output_directory}/custom/qos_bar.pdf", bbox_inches="tight")
-
-    charging = dynamic_dataset[['SmartphoneCharging[mean]', 'WearableCharging[mean]']].to_dataframe()
-    charging.rename({'SmartphoneCharging[mean]': 'SmartphoneCharging'}, axis=1, inplace=True)
-    charging.rename({'WearableCharging[mean]': 'WearableCharging'}, axis=1, inplace=True)
-    charging['Charging'] = (1 - charging['SmartphoneCharging']) * (1 - charging['WearableCharging'])
-    charging_plot = (
-        so.Plot(charging, x='Thresholds', y='Charging', color='SwapPolicy')
-        .add(so.Bar(), so.Agg(), so.Dodge())
-        .add(so.Range(), so.Est(errorbar="sd"), so.Dodge())
-        .layout(engine='tight')
-        .scale(color='viridis')
-        .label(
-            x="Thresholds",
-            y=r"Operative Devices (\%)",
-        )
-        .plot()
-    )
-    charging_plot.save(f"{output_directory}/custom/charging.pdf", bbox_inches="tight")
-    charging_plot.save(f"{output_directory}/custom/charging.svg", bbox_inches="tight")
+
+    @customChart
+    def qos_bar(metrics):
+        return ChartJob('qos_bar', barChart, metrics.statistics('MaxQoS', barBy), {
+            'ylabel': r"QoS (m/\$)",
+        }, ('pdf',))
+
+
+    @customChart
+    def charging(metrics):
+        return ChartJob('charging', barChart, metrics.statistics('Charging', barBy), {
+            'ylabel': r"Operative Devices (\%)",
+        }, ('pdf', 'svg'))
     # End plot QoS -----------------------------------------------------------------------------------------------------
 
-    power_consumption = dynamic_dataset.sum(dim='time')[['SmartphonePower[mean]', 'WearablePower[mean]', 'CloudPower[mean]']].to_dataframe()
-    power_consumption.rename({'SmartphonePower[mean]': 'SmartphonePowerConsumption'}, axis=1, inplace=True)
-    power_consumption.rename({'WearablePower[mean]': 'WearablePowerConsumption'}, axis=1, inplace=True)
-    power_consumption.rename({'CloudPower[mean]': 'CloudPower'}, axis=1, inplace=True)
-    power_consumption['PowerConsumption'] = power_consumption['SmartphonePowerConsumption'] + power_consumption['WearablePowerConsumption'] + power_consumption['CloudPower']
-    power_consumption['PowerConsumption'] = power_consumption['PowerConsumption'] / (maxTime / 3600)
-
-    power_consumption_plot = (
-        so.Plot(power_consumption, x='Thresholds', y='PowerConsumption', color='SwapPolicy')
-        .add(so.Bar(), so.Agg(), so.Dodge())
-        .add(so.Range(), so.Est(errorbar="sd"), so.Dodge())
-        .layout(engine='tight')
-        .scale(color='viridis')
-        .label(
-            x="Thresholds",
-            y=r"$P_{system} (W/h)$",
-        )
-        .plot()
-    )
-    power_consumption_plot.save(f"{output_directory}/custom/power_consumption.pdf", bbox_inches="tight")
-    power_consumption_plot.save(f"{output_directory}/custom/power_consumption.svg", bbox_inches="tight")
+
+    @customChart
+    def power_consumption(metrics):
+        return ChartJob('power_consumption', barChart, metrics.statistics('PowerConsumption', barBy), {
+            'ylabel': r"$P_{system} (W/h)$",
+        }, ('pdf', 'svg'))
     # End plot power consumption ---------------------------------------------------------------------------------------
 
-    # cost_wearable = dynamic_dataset[['PercentageSensorInWearable', 'CloudCost[sum]']].to_dataframe()
-    # cost_wearable.rename({'CloudCost[sum]': 'CloudCost'}, axis=1, inplace=True)
-    # cost_wearable_plot = (
-    #     so.Plot(cost_wearable, x='PercentageSensorInWearable', y='CloudCost', color='Thresholds')
-    #     .add(so.Line(), so.Agg())
-    #     .add(so.Band())
-    #     .layout(engine='tight', size=(20, 4))
-    #     .facet("SwapPolicy")
-    #     .scale(color='viridis')
-    #     .label(
-    #         x="Percentage of Sensors in Wearable",
-    #         y=r"Cloud Cost (\$)",
-    #         title="Sensor Allocation = {}".format
-    #     )
-    #     .plot()
-    # )
-    # cost_wearable_plot.save(f"{output_directory}/custom/cost_wearable.pdf", bbox_inches="tight")
-    # End plot cost wearable -------------------------------------------------------------------------------------------
-
-    charging_time = dynamic_dataset.max(dim='time')[['SmartphoneRechargeTime[mean]']].to_dataframe()
-    charging_time.rename({'SmartphoneRechargeTime[mean]': 'ChargingTime'}, axis=1, inplace=True)
-    charging_time = charging_time / 60
-
-    charging_time_plot = (
-        so.Plot(charging_time, x='Thresholds', y='ChargingTime', color='SwapPolicy')
-        .add(so.Bar(), so.Agg(), so.Dodge())
-        .add(so.Range(), so.Est(errorbar="sd"), so.Dodge())
-        .layout(engine='tight')
-        .scale(color='viridis')
-        .label(
-            x="Thresholds",
-            y=r"Time Spent Recharging (minutes)",
-        )
-        .plot()
-    )
-    charging_time_plot.save(f"{output_directory}/custom/charging_time.pdf", bbox_inches="tight")
-    charging_time_plot.save(f"{output_directory}/custom/charging_time.svg", bbox_inches="tight")
+        # cost_wearable = dynamic_dataset[['PercentageSensorInWearable', 'CloudCost[sum]']].to_dataframe()
+        # cost_wearable.rename({'CloudCost[sum]': 'CloudCost'}, axis=1, inplace=True)
+        # cost_wearable_plot = (
+        #     so.Plot(cost_wearable, x='PercentageSensorInWearable', y='CloudCost', color='Thresholds')
+        #     .add(so.Line(), so.Agg())
+        #     .add(so.Band())
+        #     .layout(engine='tight', size=(20, 4))
+        #     .facet("SwapPolicy")
+        #     .scale(color='viridis')
+        #     .label(
+        #         x="Percentage of Sensors in Wearable",
+        #         y=r"Cloud Cost (\$)",
+        #         title="Sensor Allocation = {}".format
+        #     )
+        #     .plot()
+        # )
+        # cost_wearable_plot.save(f"{output_directory}/custom/cost_wearable.pdf", bbox_inches="tight")
+        # End plot cost wearable -------------------------------------------------------------------------------------------
+
+
+    @customChart
+    def charging_time(metrics):
+        return ChartJob('charging_time', barChart, metrics.statistics('ChargingTime', barBy), {
+            'ylabel': r"Time Spent Recharging (minutes)",
+        }, ('pdf', 'svg'))
     # End plot charging time -------------------------------------------------------------------------------------------
 
-    performance = dynamic_dataset.max(dim='time')[['SmartphoneRechargeTime[mean]', 'CloudCost[sum]']].to_dataframe()
-    performance.rename({'SmartphoneRechargeTime[mean]': 'ChargingTime'}, axis=1, inplace=True)
-    performance.rename({'CloudCost[sum]': 'CloudCost'}, axis=1, inplace=True)
-    performance['Performance'] = (1 - (performance['ChargingTime'] / maxTime)) / performance['CloudCost']
 
-    performance_plot = (
-        so.Plot(performance, x='Thresholds', y='Performance', color='SwapPolicy')
-        .add(so.Bar(), so.Agg(), so.Dodge())
-        .add(so.Range(), so.Est(errorbar="sd"), so.Dodge())
-        .layout(engine='tight')
-        .scale(color='viridis')
-        .label(
-            x="Thresholds",
-            y=r"Performance",
-        )
-        .plot()
-    )
-    performance_plot.save(f"{output_directory}/custom/performance.pdf", bbox_inches="tight")
-    performance_plot.save(f"{output_directory}/custom/performance.svg", bbox_inches="tight")
+    @customChart
+    def performance(metrics):
+        return ChartJob('performance', barChart, metrics.statistics('Performance', barBy), {
+            'ylabel': r"Performance",
+        }, ('pdf', 'svg'))
     # End plot performance -------------------------------------------------------------------------------------------
+
+
+    def relabel(dataset):
+        """
+        Relabels the thresholds and sorts the coordinates as the charts show them.
+        """
+        if 'run' in dataset.dims:
+            # Stacked layout: relabel the levels and sort the runs, as reindexing does on the grid
+            import pandas as pd
+            runs = dataset.indexes['run'].to_frame(index=False)
+            runs['Thresholds'] = runs['Thresholds'].map(thresholds)
+            orders = {'Thresholds': thresholds_ordered, 'SwapPolicy': ordered_policies}
+            runs = runs.sort_values(
+                list(runs.columns),
+                key=lambda level: level.map({v: i for i, v in enumerate(orders[level.name])}) if level.name in orders else level,
+                kind='stable',
+            )
+            dataset = dataset.drop_vars(['run', *runs.columns]).isel(run=runs.index.values)
+            return dataset.assign_coords(xr.Coordinates.from_pandas_multiindex(pd.MultiIndex.from_frame(runs), 'run'))
+        dataset = dataset.assign_coords(Thresholds=[thresholds[value] for value in dataset['Thresholds'].values])
+        return dataset.reindex(Thresholds=thresholds_ordered).reindex(SwapPolicy=ordered_policies)
+
+
+    def renderCustomCharts(means, names, pyramids=None):
+        """
+        Draws the charts names from the means of the experiments,
+        and from the levels of their time pyramids (see loadPyramid) if any.
+        """
+        dynamic_dataset = relabel(means['dynamic'])
+        levels = {resolution: relabel(level) for resolution, level in (pyramids or {}).get('dynamic', {}).items()}
+        metrics = DerivedMetrics(dynamic_dataset, derivedMetrics(), metricReductions(dynamic_dataset, levels))
+        jobs = [customCharts[name](metrics) for name in names]
+        Path(statisticsOutput).parent.mkdir(parents=True, exist_ok=True)
+        metrics.table().to_csv(f'{statisticsOutput}.tmp', index=False)
+        os.replace(f'{statisticsOutput}.tmp', statisticsOutput)
+        renderCharts(jobs, f'{output_directory}/custom', workers)
+
+
+    # COMMAND LINE
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Processes the Alchemist data files and draws the charts. Without a command, runs everything.')
+    parser.add_argument('--workers', type=int, default=workers, help='number of processes, defaults to every available core')
+    parser.add_argument(
+        '--low-memory', action='store_true', default=lowMemory,
+        help=f'store the data as float32 on memory-mapped files in {cacheDirectory}, for sweeps that do not fit in memory',
+    )
+    parser.add_argument('--profile', choices=['cprofile', 'tracemalloc'], default=profile, help=f'dump per-stage profiles in {profileDirectory}')
+    parser.add_argument('--data', default=directory, help='directory of the data files, e.g. the output of surrogate.py')
+    parser.add_argument('--charts', default=output_directory, help='where to save the charts')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('ingest', help='parse and resample the new or changed data files')
+    commands.add_parser('aggregate', help='ingest, then fold the seeds and update the summary')
+    reprocessCommand = commands.add_parser('reprocess', help='ingest again the files with the given coordinates, updating their slice of the summary')
+    reprocessCommand.add_argument('where', nargs='+', metavar='name=value', help='coordinates of the files, repeat a name to accept more values')
+    chartCommand = commands.add_parser('chart', help='draw charts from the summary, aggregating first if it is missing')
+    chartCommand.add_argument('names', nargs='*', metavar='name', help='the charts to draw, all if none is given')
+    watchCommand = commands.add_parser('watch', help='follow the data files while the simulations write them, redrawing some charts')
+    watchCommand.add_argument('names', nargs='*', metavar='name', help='the charts to redraw, all if none is given')
+    watchCommand.add_argument('--interval', type=float, default=30, help='seconds between refreshes')
+    listCommand = commands.add_parser('list', help='list the experiments, their coordinates, and the charts')
+    listCommand.add_argument('where', nargs='*', metavar='name=value', help='list the files with these coordinates')
+    arguments = parser.parse_args()
+    workers = arguments.workers
+    lowMemory = arguments.low_memory
+    if arguments.data != directory:
+        # Other data directories get their own summary and cache, not to replace those of the experiment
+        directory = arguments.data
+        summaryOutput = f"{directory.rstrip('/')}_summary.zarr"
+        cacheDirectory = f'{cacheDirectory}/{Path(directory).resolve().name}'
+        fileIndex = FileIndex(directory, f'{cacheDirectory}/files', verifyFileNames)
+    if chartResolution is not None and (chartResolution not in timeResolutions or chartResolution > window_in_seconds):
+        parser.error(f'chartResolution must be one of timeResolutions, up to the {window_in_seconds}s window of the time series')
+    if arguments.charts != output_directory:
+        output_directory = arguments.charts
+        statisticsOutput = f'{output_directory}/custom/statistics.csv'
+    unknown = [name for name in getattr(arguments, 'names', []) if name not in customCharts]
+    if unknown:
+        parser.error(f'unknown charts {", ".join(unknown)}, available: {", ".join(customCharts)}')
+    instrumentation.configure(arguments.profile, profileDirectory)
+    where = collections.defaultdict(list)
+    for condition in getattr(arguments, 'where', []):
+        name, separator, value = condition.partition('=')
+        if not separator:
+            parser.error(f'expected name=value, got {condition}')
+        where[name].append(FileIndex.parseValue(value))
+    if where:
+        # Unknown names would silently match no file
+        coordinateNames = {name for experiment in experiments for name in experimentDimensions(discoverFiles(experiment))}
+        unknown = sorted(set(where) - coordinateNames)
+        if unknown:
+            parser.error(f'unknown coordinates {", ".join(unknown)}, available: {", ".join(sorted(coordinateNames))}')
+    if arguments.command == 'list':
+        listExperiments(where)
+    elif arguments.command == 'reprocess':
+        reprocessData(where)
+    elif arguments.command == 'ingest':
+        processData(aggregate=False)
+    elif arguments.command == 'aggregate':
+        processData()
+    elif arguments.command == 'watch':
+        if minTime is None or maxTime is None:
+            parser.error('watch needs minTime and maxTime, the simulations have not finished yet')
+        watchData(arguments.names or list(customCharts), arguments.interval)
+    elif arguments.command == 'chart':
+        means, stdevs = loadSummary(summaryOutput, experiments)
+        if means.keys() != set(experiments):
+            means, stdevs = processData()
+        renderCustomCharts(means, arguments.names or list(customCharts), loadPyramids())
+    else:
+        means, stdevs = processData()
+        if allCharts:
+            renderAllCharts(means, stdevs)
+        renderCustomCharts(means, list(customCharts), loadPyramids())
+    if arguments.command != 'list':
+        instrumentation.save(reportOutput)
@@ -0,0 +1,96 @@
+package it.unibo.alchemist.boundary.exporters
+
+import it.unibo.alchemist.model.Actionable
+import it.unibo.alchemist.model.Environment
+import it.unibo.alchemist.model.Position
+import it.unibo.alchemist.model.Time
+import java.io.File
+import java.io.RandomAccessFile
+import java.nio.ByteBuffer
+import java.nio.ByteOrder
+import java.nio.channels.FileChannel
+import java.nio.file.Files
+import java.nio.file.StandardCopyOption
+
+/**
+ * Binary alternative to the CSVExporter: each run is written as a little-endian float64 matrix in the NumPy `.npy`
+ * format, one row per sample and one column per extracted value, so that it can be memory-mapped with no parsing.
+ * A JSON file with the same name holds the variables of the run (as in the header of the CSV files),
+ * the column names, and whether the simulation finished.
+ * Rows are appended while the simulation runs, the shape in the `.npy` header is updated when it finishes.
+ */
+class NpyExporter<T, P : Position<P>> @JvmOverloads constructor(
+    private val fileNameRoot: String = "",
+    val interval: Double = 1.0,
+    private val exportPath: String = "data",
+) : AbstractExporter<T, P>(interval) {
+    private lateinit var basePath: String
+    private lateinit var columns: List<String>
+    private lateinit var channel: FileChannel
+    private lateinit var row: ByteBuffer
+    private var rows = 0L
+
+    override fun setup(environment: Environment<T, P>) {
+        File(exportPath).mkdirs()
+        val name = listOf(fileNameRoot, variablesDescriptor).filter(String::isNotBlank).joinToString(separator = "_")
+        basePath = "$exportPath${File.separator}$name"
+        columns = dataExtractors.flatMap { it.columnNames }
+        row = ByteBuffer.allocate(Double.SIZE_BYTES * columns.size).order(ByteOrder.LITTLE_ENDIAN)
+        channel = RandomAccessFile("$basePath.npy", "rw").channel
+        channel.truncate(0)
+        channel.write(header(0), 0)
+        writeDescriptor(finished = false)
+    }
+
+    override fun exportData(environment: Environment<T, P>, reaction: Actionable<T>?, time: Time, step: Long) {
+        row.clear()
+        dataExtractors.forEach { extractor ->
+            val values = extractor.extractData(environment, reaction, time, step)
+            extractor.columnNames.forEach { column ->
+                row.putDouble((values[column] as? Number)?.toDouble() ?: Double.NaN)
+            }
+        }
+        row.flip()
+        channel.write(row, HEADER_SIZE + rows * row.capacity())
+        rows++
+    }
+
+    override fun close(environment: Environment<T, P>, time: Time, step: Long) {
+        channel.write(header(rows), 0)
+        channel.close()
+        writeDescriptor(finished = true)
+    }
+
+    private fun header(rows: Long): ByteBuffer {
+        val description = "{'descr': '<f8', 'fortran_order': False, 'shape': ($rows, ${columns.size}), }"
+        val dictionary = description.padEnd(HEADER_SIZE - PREAMBLE_SIZE - 1) + "\n"
+        return ByteBuffer.allocate(HEADER_SIZE).order(ByteOrder.LITTLE_ENDIAN).apply {
+            put(MAGIC)
+            put(1)
+            put(0)
+            putShort((HEADER_SIZE - PREAMBLE_SIZE).toShort())
+            put(dictionary.toByteArray(Charsets.US_ASCII))
+            flip()
+        }
+    }
+
+    private fun writeDescriptor(finished: Boolean) {
+        val columnList = columns.joinToString(separator = ", ", prefix = "[", postfix = "]") { quote(it) }
+        val descriptor = """{"variables": ${quote(verboseVariablesDescriptor)}, "columns": $columnList, "finished": $finished}"""
+        val temporary = File("$basePath.json.tmp")
+        temporary.writeText(descriptor + "\n")
+        Files.move(temporary.toPath(), File("$basePath.json").toPath(), StandardCopyOption.REPLACE_EXISTING)
+    }
+
+    private companion object {
+        private val MAGIC = byteArrayOf(0x93.toByte(), 'N'.code.toByte(), 'U'.code.toByte(), 'M'.code.toByte(), 'P'.code.toByte(), 'Y'.code.toByte())
+        private const val PREAMBLE_SIZE = 10
+        private const val HEADER_SIZE = 256
+
+        private fun quote(text: String): String = text
+            .replace("\\", "\\\\")
+            .replace("\"", "\\\"")
+            .replace("\n", "\\n")
+            .let { "\"$it\"" }
+    }
+}
@@ -0,0 +1,415 @@
+"""
+Surrogate of the dynamic allocation simulation: the battery, consumption and offloading dynamics of
+PowerManagerImpl, the consumption models, PulverizationAction and PulverizationCloudAction,
+rewritten as a batched NumPy simulation advancing every (run, device) lane at once.
+Runs are written in the format of the Alchemist CSV exporter, so that process.py can chart them
+(`python process.py --data surrogate --charts charts/surrogate`), and a Thresholds x SwapPolicy grid
+can be screened in seconds before running the full simulations.
+
+Movement on the map is not simulated: each device walks legs of exponentially distributed length
+between points of interest, at the speed of the simulation.
+
+Run `python surrogate.py --help` for the available options.
+"""
+import argparse
+import collections
+import itertools
+import os
+import time
+
+import numpy as np
+
+import process
+
+
+class Scenario(collections.namedtuple('Scenario', [
+    'devices', 'smartphoneEpi', 'wearableEpi', 'cloudEpi',
+    'smartphoneOsInstructions', 'wearableOsInstructions', 'cloudOsInstructions',
+    'gpsInstructions', 'communicationInstructions', 'behaviorInstructions',
+    'smartphoneCapacity', 'wearableCapacity', 'smartphoneRechargeTime', 'wearableRechargeTime',
+    'cloudCost', 'instancePower', 'voltage', 'chargingProbability', 'chargingDelay',
+    'speed', 'maxTimeInPoi', 'legLength',
+], defaults=[
+    300, 5.50E-9, 9.97E-10, 100.0E-9,
+    31_250, 3_124, 50_000,
+    37_500, 6_250, 50_000,
+    4500.0, 306.0, 2.0, 1.5,
+    3.584, 220.0, 3.3, 0.1, 600.0,
+    1.4, 1800.0, 900.0,
+])):
+    """
+    Parameters of the simulated scenario, defaulting to those of src/main/yaml/dynamicAllocation.yml.
+
+    Attributes
+    ----------
+    devices : int
+        people, each one carrying a smartphone and a wearable
+    smartphoneEpi, wearableEpi, cloudEpi : float
+        energy per instruction, in Joules
+    smartphoneOsInstructions, wearableOsInstructions, cloudOsInstructions : int
+        instructions of the operating system, each step executes a uniformly distributed fraction of them
+    gpsInstructions, communicationInstructions, behaviorInstructions : int
+        instructions of the components
+    smartphoneCapacity, wearableCapacity : float
+        battery capacities, in mAh
+    smartphoneRechargeTime, wearableRechargeTime : float
+        the average recharge time parameters of PowerManagerImpl
+    cloudCost : float
+        cost of a cloud instance, in $/hour
+    instancePower : float
+        power of a cloud instance, in W
+    voltage : float
+        battery voltage, in V
+    chargingProbability : float
+        probability of a device to be charging when the simulation starts
+    chargingDelay : float
+        mean of the exponentially distributed delay added to each recharge, in seconds
+    speed : float
+        walking speed, in m/s
+    maxTimeInPoi : float
+        maximum time between the departure towards a point of interest and the next one, in seconds
+    legLength : float
+        mean distance between consecutive points of interest, in meters (surrogate of the map)
+    """
+    __slots__ = ()
+
+
+# Exported molecules and their aggregators, as in the data files of the repository
+EXPORTED = {
+    'IsMoving': ['mean', 'sum'],
+    'SmartphoneCurrentCapacity': ['mean'],
+    'WearableCurrentCapacity': ['mean'],
+    'SmartphoneCharging': ['mean', 'sum'],
+    'WearableCharging': ['mean', 'sum'],
+    'SmartphoneComponentsTime': ['mean', 'sum'],
+    'WearableComponentsTime': ['mean', 'sum'],
+    'CloudComponentsTime': ['mean', 'sum'],
+    'TraveledDistance': ['mean', 'sum', 'min', 'max'],
+    'CloudPower': ['mean', 'sum'],
+    'SmartphonePower': ['mean', 'sum'],
+    'WearablePower': ['mean', 'sum'],
+    'CloudCost': ['sum'],
+    'CloudInstance': ['sum'],
+    'SmartphoneRechargeTime': ['mean'],
+    'WearableRechargeTime': ['mean'],
+}
+EXTRACTED = ['PercentageSensorInWearable', 'BehaviorOffloadedInCloud']
+
+
+def exportedColumns(exported=EXPORTED):
+    return ['time'] + [f'{molecule}[{aggregator}]' for molecule, aggregators in exported.items() for aggregator in aggregators] + EXTRACTED
+
+
+def aggregate(values, aggregator):
+    """
+    Aggregates the values of a molecule over the nodes, along the last axis, as the Alchemist exporter does:
+    NaN marks the nodes that do not hold the molecule yet, and are skipped.
+    """
+    count = np.sum(~np.isnan(values), axis=-1)
+    total = np.nansum(values, axis=-1)
+    if aggregator == 'sum':
+        return total
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if aggregator == 'mean':
+            return np.where(count > 0, total / count, np.nan)
+        masked = np.where(np.isnan(values), np.inf if aggregator == 'min' else -np.inf, values)
+        extreme = masked.min(axis=-1) if aggregator == 'min' else masked.max(axis=-1)
+        return np.where(count > 0, extreme, np.nan)
+
+
+def simulate(runs, scenario=Scenario(), duration=16 * 3600.0, interval=60.0, step=1.0, seed=0, exported=EXPORTED):
+    """
+    Simulates the runs side by side, one lane per device of each run.
+    Every step executes, on each lane, the actions of the simulation (they run once per second),
+    scaled by step seconds: steps longer than a second trade accuracy for speed.
+
+    Parameters
+    ----------
+    runs : list of dict
+        the coordinates of each run: Seed, Thresholds (a pair of percentages) and SwapPolicy (smartphone, wearable or hybrid)
+    scenario : Scenario
+        the parameters of the simulation
+    duration : float
+        simulated time, in seconds
+    interval : float
+        time between exported rows, in seconds
+    step : float
+        simulated time per step, in seconds
+    seed : int
+        seed of the sweep, combined with the Seed of each run into the seed of its random generator:
+        the results of a run do not depend on the other runs simulated with it,
+        and the runs with the same Seed draw the same random numbers whatever their Thresholds and SwapPolicy
+    exported : dict
+        the exported molecules, mapped to their aggregators
+
+    Returns
+    -------
+    np.ndarray
+        The exported values, shaped (run, row, column) with the columns of exportedColumns(exported)
+    """
+    s = scenario
+    generators = [np.random.default_rng(np.random.SeedSequence([seed, int(run.get('Seed', 0))])) for run in runs]
+    shape = (len(runs), s.devices)
+    minThreshold = np.array([float(run['Thresholds'][0]) for run in runs])[:, None]
+    policies = np.array([run['SwapPolicy'] for run in runs])[:, None]
+    if not np.isin(policies, ['smartphone', 'wearable', 'hybrid']).all():
+        raise ValueError(f'Invalid swap policy in {set(policies.ravel())}')
+    hybrid = policies == 'hybrid'
+
+    def draw(distribution, size, *parameters):
+        # Each run draws from its own generator, in the same order whatever the runs next to it
+        return np.stack([getattr(generator, distribution)(*parameters, size=size) for generator in generators])
+
+    # PowerManagerImpl
+    smartphone = s.smartphoneCapacity * (0.6 + 0.4 * draw('random', s.devices))
+    wearable = s.wearableCapacity * (0.6 + 0.4 * draw('random', s.devices))
+    smartphoneCharging = draw('random', s.devices) > 1 - s.chargingProbability
+    wearableCharging = draw('random', s.devices) > 1 - s.chargingProbability
+    smartphoneDelay = draw('exponential', s.devices, s.chargingDelay)
+    wearableDelay = draw('exponential', s.devices, s.chargingDelay)
+    # Devices always recharge together, their recharge times are the same
+    rechargeTime = np.zeros(shape)
+    # Components and swap policies
+    gpsInWearable = np.broadcast_to(policies != 'smartphone', shape).copy()
+    behaviorInSmartphone = np.ones(shape, dtype=bool)
+    smartphoneWhenSwap = np.full(shape, s.smartphoneCapacity)
+    wearableWhenSwap = np.full(shape, s.wearableCapacity)
+    # Exported molecules, NaN until set
+    molecules = {name: np.full(shape, np.nan) for name in [
+        'SmartphoneCurrentCapacity', 'WearableCurrentCapacity', 'SmartphoneCharging', 'WearableCharging',
+        'SmartphoneComponentsTime', 'WearableComponentsTime', 'TraveledDistance', 'SmartphonePower', 'WearablePower',
+        'SmartphoneRechargeTime', 'WearableRechargeTime',
+    ]}
+    molecules['IsMoving'] = np.ones(shape)
+    for name in ['CloudComponentsTime', 'CloudPower', 'CloudCost']:
+        molecules[name] = np.full((len(runs), 1), np.nan)
+    molecules['CloudInstance'] = np.ones((len(runs), 1))
+    smartphoneTime = np.zeros(shape)
+    wearableTime = np.zeros(shape)
+    cloudTime = np.zeros((len(runs), 1))
+    cloudCost = np.zeros((len(runs), 1))
+    # Movement
+    distance = np.zeros(shape)
+    remaining = np.zeros(shape)
+    departure = np.full(shape, -np.inf)
+    timeInPoi = np.zeros(shape)
+
+    def rechargeRate(capacity, rechargeTime, delay):
+        # PowerManagerImpl.rechargeStep, mAh recharged in one second
+        return (capacity / rechargeTime) / (3600 + delay)
+
+    def consumption(instructions, epi):
+        # ConsumptionModel.getConsumptionSinceLastUpdate, in W, one second after the last update
+        return instructions * epi * 3600
+
+    def toMilliAmpsHour(power):
+        # PowerManagerImpl.managePowerConsumption, mAh consumed in one second
+        return power * 1000 / s.voltage / 3600.0
+
+    def resample(mask, values, drawn):
+        # Takes new values only where needed, most lanes keep theirs at each step
+        if mask.any():
+            values[mask] = drawn[mask]
+
+    def export(now):
+        row = [np.full(len(runs), now)]
+        for molecule, aggregators in exported.items():
+            row += [aggregate(molecules[molecule], aggregator) for aggregator in aggregators]
+        started = not np.isnan(molecules['SmartphoneCharging']).all()
+        row.append(100.0 * gpsInWearable.mean(axis=1) if started else np.zeros(len(runs)))
+        row.append(100.0 * (~behaviorInSmartphone).mean(axis=1))
+        return np.column_stack(row)
+
+    smartphoneRate = rechargeRate(s.smartphoneCapacity, s.smartphoneRechargeTime, smartphoneDelay)
+    wearableRate = rechargeRate(s.wearableCapacity, s.wearableRechargeTime, wearableDelay)
+    steps = int(round(duration / step))
+    every = max(int(round(interval / step)), 1)
+    rows = [export(0.0)]
+    for index in range(1, steps + 1):
+        now = index * step
+        if (index - 1) % every == 0:
+            # Instructions of the operating systems, and a new value of each lane in case it needs one,
+            # drawn for the steps until the next export at once
+            noise = draw('random', (every, 2, s.devices))
+            cloudNoise = draw('random', (every, 1))
+            delays = draw('exponential', (every, 2, s.devices), s.chargingDelay)
+            legs = draw('exponential', (every, s.devices), s.legLength)
+            stays = s.maxTimeInPoi * draw('random', (every, s.devices))
+        smartphoneNoise, wearableNoise = noise[:, (index - 1) % every].swapaxes(0, 1)
+        smartphoneNewDelay, wearableNewDelay = delays[:, (index - 1) % every].swapaxes(0, 1)
+        # PulverizationAction: a device charging stops the other one too
+        charging = smartphoneCharging | wearableCharging
+        smartphoneCharging = charging.copy()
+        wearableCharging = charging.copy()
+        using = ~charging
+        instructions = (
+            behaviorInSmartphone * s.behaviorInstructions + ~gpsInWearable * s.gpsInstructions
+            + s.communicationInstructions + s.smartphoneOsInstructions * smartphoneNoise
+        )
+        power = consumption(instructions, s.smartphoneEpi)
+        smartphone -= using * (step * toMilliAmpsHour(power))
+        smartphoneCharging |= smartphone < 0.0
+        np.maximum(smartphone, 0.0, out=smartphone)
+        np.copyto(molecules['SmartphonePower'], power, where=using)
+        instructions = gpsInWearable * s.gpsInstructions + s.wearableOsInstructions * wearableNoise
+        power = consumption(instructions, s.wearableEpi)
+        wearable -= using * (step * toMilliAmpsHour(power))
+        wearableCharging |= wearable < 0.0
+        np.maximum(wearable, 0.0, out=wearable)
+        np.copyto(molecules['WearablePower'], power, where=using)
+        # PowerManagerImpl.rechargeStep
+        smartphone += charging * (step * smartphoneRate)
+        wearable += charging * (step * wearableRate)
+        rechargeTime += step * charging
+        full = charging & (smartphone >= s.smartphoneCapacity)
+        smartphoneCharging &= ~full
+        np.minimum(smartphone, s.smartphoneCapacity, out=smartphone)
+        resample(full, smartphoneDelay, smartphoneNewDelay)
+        smartphoneRate[full] = rechargeRate(s.smartphoneCapacity, s.smartphoneRechargeTime, smartphoneDelay[full])
+        full = charging & (wearable >= s.wearableCapacity)
+        wearableCharging &= ~full
+        np.minimum(wearable, s.wearableCapacity, out=wearable)
+        resample(full, wearableDelay, wearableNewDelay)
+        wearableRate[full] = rechargeRate(s.wearableCapacity, s.wearableRechargeTime, wearableDelay[full])
+        moving = ~((smartphone <= 0.0) | (wearable <= 0.0) | charging)
+        # manageBehaviorAllocation
+        percentage = smartphone / s.smartphoneCapacity * 100
+        behaviorInSmartphone &= ~((percentage < minThreshold) & ~smartphoneCharging)
+        behaviorInSmartphone |= smartphoneCharging | (minThreshold == 0.0)
+        behaviorInSmartphone &= ~(minThreshold == 100.0)
+        # HybridSwapPolicyManager
+        np.maximum(smartphoneWhenSwap, smartphone, out=smartphoneWhenSwap)
+        np.maximum(wearableWhenSwap, wearable, out=wearableWhenSwap)
+        wearablePercentage = wearable / s.wearableCapacity * 100
+        toSmartphone = hybrid & gpsInWearable & (
+            (wearableWhenSwap - wearable) / s.wearableCapacity * 100 > 5.0
+        ) & (wearablePercentage < percentage)
+        toWearable = hybrid & ~gpsInWearable & (
+            (smartphoneWhenSwap - smartphone) / s.smartphoneCapacity * 100 > 5.0
+        ) & (percentage < wearablePercentage)
+        gpsInWearable = (gpsInWearable & ~toSmartphone) | toWearable
+        np.copyto(smartphoneWhenSwap, smartphone, where=toSmartphone)
+        np.copyto(wearableWhenSwap, wearable, where=toWearable)
+        smartphoneTime += step * (behaviorInSmartphone + ~gpsInWearable + 1)
+        wearableTime += step * gpsInWearable
+        # ConfigureNextPoi, TargetMapWalker and TraveledDistanceAction
+        leave = moving & (remaining <= 0.0) & (now - departure >= timeInPoi)
+        resample(leave, remaining, legs[:, (index - 1) % every])
+        resample(leave, timeInPoi, stays[:, (index - 1) % every])
+        departure[leave] = now
+        walked = moving * np.minimum(s.speed * step, remaining)
+        remaining -= walked
+        distance += walked
+        # PulverizationCloudAction
+        offloaded = (~behaviorInSmartphone).sum(axis=1, keepdims=True)
+        instructions = offloaded * s.behaviorInstructions + s.cloudOsInstructions * cloudNoise[:, (index - 1) % every]
+        cloudPower = consumption(instructions, s.cloudEpi)
+        instances = np.ceil(cloudPower / s.instancePower)
+        cloudCost += step * s.cloudCost / 3600 * instances
+        cloudTime += step * offloaded
+        if index % every == 0:
+            molecules.update({
+                'IsMoving': moving.astype(float),
+                'SmartphoneCurrentCapacity': smartphone.copy(),
+                'WearableCurrentCapacity': wearable.copy(),
+                'SmartphoneCharging': charging.astype(float),
+                'WearableCharging': charging.astype(float),
+                'SmartphoneComponentsTime': smartphoneTime,
+                'WearableComponentsTime': wearableTime,
+                'TraveledDistance': distance,
+                'SmartphoneRechargeTime': rechargeTime,
+                'WearableRechargeTime': rechargeTime,
+                'CloudComponentsTime': cloudTime,
+                'CloudPower': cloudPower,
+                'CloudCost': cloudCost,
+                'CloudInstance': instances,
+            })
+            rows.append(export(now))
+    return np.stack(rows, axis=1)
+
+
+def fileName(experiment, coordinates):
+    """
+    Returns the name the Alchemist exporter gives to the file of a run.
+    """
+    return '_'.join([experiment] + [f'{k}-{v}' for k, v in coordinates.items()]) + '.csv'
+
+
+def runSweep(directory, seeds, thresholds, policies, experiment='dynamic', batch=None, **options):
+    """
+    Simulates every combination of seeds, thresholds and policies and writes one file per run.
+
+    Parameters
+    ----------
+    directory : str
+        where to write the files
+    seeds : list of int
+        the seeds, one replica of each combination per seed
+    thresholds : list of tuple
+        the (min, max) thresholds, in percentage
+    policies : list of str
+        the swap policies
+    experiment : str
+        the prefix of the file names, as the fileNameRoot of the exporter
+    batch : int, optional
+        the number of runs simulated together, all of them if None
+    options : dict
+        passed to simulate
+
+    Returns
+    -------
+    list of str
+        The paths of the files
+    """
+    os.makedirs(directory, exist_ok=True)
+    columns = exportedColumns(options.get('exported', EXPORTED))
+    runs = [
+        {'Seed': float(seed), 'Thresholds': pair, 'SwapPolicy': policy}
+        for seed, pair, policy in itertools.product(seeds, thresholds, policies)
+    ]
+    size = batch or len(runs)
+    paths = []
+    for start in range(0, len(runs), size):
+        chunk = runs[start:start + size]
+        for run, matrix in zip(chunk, simulate(chunk, **options)):
+            low, high = run['Thresholds']
+            coordinates = {**run, 'Thresholds': f'[{float(low)}, {float(high)}]'}
+            path = f'{directory}/{fileName(experiment, coordinates)}'
+            process.writeCsv(path, coordinates, columns, matrix)
+            paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    defaults = Scenario()
+
+    parser = argparse.ArgumentParser(description='Simulates the battery and consumption dynamics of the experiment with NumPy.')
+    parser.add_argument('--output', default='surrogate', help='directory to write the files in')
+    parser.add_argument('--experiment', default='dynamic', help='prefix of the file names')
+    parser.add_argument('--seeds', type=int, default=5, help='replicas of each combination')
+    parser.add_argument(
+        '--thresholds', nargs='+', default=['0,0', '10,100', '20,100', '30,100', '40,100', '100,100'], metavar='MIN,MAX',
+        help='the thresholds to simulate, in percentage',
+    )
+    parser.add_argument('--policies', nargs='+', default=['smartphone', 'wearable', 'hybrid'], choices=['smartphone', 'wearable', 'hybrid'])
+    parser.add_argument('--devices', type=int, default=defaults.devices)
+    parser.add_argument('--leg-length', type=float, default=defaults.legLength, help='mean distance between points of interest, in meters')
+    parser.add_argument('--duration', type=float, default=16 * 3600.0, help='simulated seconds')
+    parser.add_argument('--interval', type=float, default=60.0, help='seconds between exported rows')
+    parser.add_argument('--step', type=float, default=10.0, help='simulated seconds per step, 1 follows the simulation event by event')
+    parser.add_argument('--batch', type=int, help='runs simulated together, all of them by default')
+    arguments = parser.parse_args()
+    thresholds = []
+    for pair in arguments.thresholds:
+        try:
+            low, high = map(float, pair.split(','))
+        except ValueError:
+            parser.error(f'expected MIN,MAX thresholds, got {pair}')
+        thresholds.append((low, high))
+    start = time.perf_counter()
+    paths = runSweep(
+        arguments.output, range(arguments.seeds), thresholds, arguments.policies, arguments.experiment, arguments.batch,
+        scenario=defaults._replace(devices=arguments.devices, legLength=arguments.leg_length),
+        duration=arguments.duration, interval=arguments.interval, step=arguments.step,
+    )
+    print(f'{len(paths)} runs written to {arguments.output} in {time.perf_counter() - start:.1f}s')
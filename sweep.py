@@ -0,0 +1,452 @@
+"""
+Runs the simulations of a sweep on the local cores as independent jobs, one per combination of the free variables
+of a simulation file (e.g. Seed, Thresholds and SwapPolicy of src/main/yaml/dynamicAllocation.yml),
+instead of a single Alchemist batch that delivers its data files only when every run is over.
+Jobs are scheduled on a bounded pool of processes, retried when they fail or exceed their timeout,
+and recorded in a resumable queue: an interrupted sweep continues from the jobs still to do.
+The data file of each finished job is moved to the data directory, and process.py ingests it while the others run.
+
+Run `python sweep.py --help` for the available options.
+"""
+import argparse
+import collections
+import copy
+import glob
+import itertools
+import json
+import os
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import yaml
+
+import process
+
+
+def isArbitrary(definition):
+    return str(definition.get('type', '')).split('.')[-1] == 'ArbitraryVariable'
+
+
+def isLinear(definition):
+    return {'min', 'max', 'step'} <= definition.keys()
+
+
+def sweepVariables(document):
+    """
+    Returns the free variables of a simulation, mapped to their values in declaration order:
+    the range of the linear ones (min, max, step) and the second parameter of the ArbitraryVariable ones.
+    Values of linear variables are floats, as Alchemist exports them.
+    """
+    variables = {}
+    for name, definition in document.get('variables', {}).items():
+        if not isinstance(definition, dict):
+            continue
+        if isArbitrary(definition):
+            variables[name] = list(definition['parameters'][1])
+        elif isLinear(definition):
+            low, high, step = (float(definition[k]) for k in ('min', 'max', 'step'))
+            variables[name] = [low + idx * step for idx in range(int((high - low) / step + 1e-9) + 1)]
+    return variables
+
+
+def formatValue(value):
+    """
+    Formats a variable value as Alchemist does in the names and headers of the data files, e.g. [10.0, 100.0].
+    """
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, (int, float)):
+        return str(float(value))
+    if isinstance(value, (list, tuple)):
+        return '[' + ', '.join(formatValue(v) for v in value) + ']'
+    return str(value)
+
+
+def jobName(coordinates):
+    """
+    Returns the name of the job of a combination of values, as the variables descriptor of the exporters.
+    """
+    return '_'.join(f'{k}-{formatValue(v)}' for k, v in coordinates.items())
+
+
+def exporters(document):
+    """
+    Returns the parameters of the exporters of a simulation, which must be given by name.
+    """
+    parameters = [exporter.get('parameters', {}) for exporter in document.get('export', [])]
+    if not all(isinstance(p, dict) for p in parameters):
+        raise ValueError('the parameters of the exporters must be given by name, e.g. exportPath: "data"')
+    return parameters
+
+
+def jobSimulation(document, coordinates, exportPath):
+    """
+    Returns a copy of a simulation running just one combination of its free variables,
+    exporting its data to exportPath.
+
+    The definitions of the variables are pinned in place, so that the anchors referring to them
+    (e.g. the seeds, or the parameters of the actions) keep matching them.
+    The combination is still run as a batch, for the exporters to name and describe the data files as in a full sweep.
+    """
+    job = copy.deepcopy(document)
+    for name, value in coordinates.items():
+        definition = job['variables'][name]
+        if isArbitrary(definition):
+            definition['parameters'][:] = [value, [copy.deepcopy(value)]]
+        else:
+            definition.update(min=value, max=value, default=value)
+    for parameters in exporters(job):
+        parameters['exportPath'] = str(exportPath)
+    launcher = job.setdefault('launcher', {})
+    launcher.setdefault('parameters', {}).update(
+        batch=list(coordinates), autoStart=True, showProgress=False, parallelism=1,
+    )
+    return job
+
+
+class JobQueue:
+    """
+    Resumable on-disk queue of the jobs of a sweep: a journal with a JSON line per change of a job,
+    replayed and compacted when opened, so that each change costs a short append.
+    Jobs interrupted while running are pending again.
+
+    Each job has a name, its coordinates, a status (pending, running, done, or failed), the number of attempts,
+    and the seconds and error of the last attempt.
+
+    Parameters
+    ----------
+    path : str
+        where to store the journal
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.jobs = {}
+        try:
+            with open(self.path) as journal:
+                for line in journal:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        break  # The last change was not written completely
+                    self.jobs.setdefault(change['name'], {}).update(change)
+        except FileNotFoundError:
+            pass
+        for job in self.jobs.values():
+            if job['status'] == 'running':
+                job['status'] = 'pending'
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f'{self.path}.tmp', 'w') as compacted:
+            for job in self.jobs.values():
+                compacted.write(json.dumps(job) + '\n')
+        os.replace(f'{self.path}.tmp', self.path)
+        self.journal = open(self.path, 'a')
+
+    def add(self, name, coordinates):
+        if name not in self.jobs:
+            self.update(name, coordinates=coordinates, status='pending', attempts=0)
+
+    def update(self, name, **changes):
+        self.jobs.setdefault(name, {'name': name}).update(changes)
+        self.journal.write(json.dumps({'name': name, **changes}) + '\n')
+        self.journal.flush()
+
+    def close(self):
+        self.journal.close()
+
+
+Running = collections.namedtuple('Running', ['process', 'started', 'directory', 'log'])
+
+
+def outputNames(document, name):
+    """
+    Returns the names the exporters give to the data files of a job.
+    """
+    return [f"{p.get('fileNameRoot', '')}_{name}".lstrip('_') for p in exporters(document)]
+
+
+def exported(dataDirectory, stems):
+    """
+    Returns whether the data files with the given names (without extension) are in dataDirectory.
+    """
+    return bool(stems) and all(
+        any(os.path.exists(f'{dataDirectory}/{stem}{extension}') for extension in process.EXPORT_EXTENSIONS)
+        for stem in stems
+    )
+
+
+def startJob(name, job, document, command, stagingDirectory, environment):
+    """
+    Launches the simulation of a job in its own directory of stagingDirectory, logging its output there.
+    """
+    directory = Path(stagingDirectory) / name
+    shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir(parents=True)
+    simulation = directory / 'simulation.yml'
+    with open(simulation, 'w') as file:
+        yaml.safe_dump(jobSimulation(document, job['coordinates'], (directory / 'data').resolve()), file, sort_keys=False)
+    log = open(directory / 'output.log', 'w')
+    started = subprocess.Popen(
+        command + [str(simulation)], stdout=log, stderr=subprocess.STDOUT, env=environment, start_new_session=True,
+    )
+    return Running(started, time.monotonic(), directory, log)
+
+
+def stopJob(running):
+    """
+    Kills a job with the processes it started.
+    """
+    try:
+        os.killpg(running.process.pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError):
+        running.process.kill()
+    running.process.wait()
+    running.log.close()
+
+
+def collectOutputs(directory, dataDirectory):
+    """
+    Moves the data files exported by a job to dataDirectory, the binary exports after their descriptors
+    (see process.FileIndex.refresh), and returns their new paths.
+    """
+    os.makedirs(dataDirectory, exist_ok=True)
+    paths = []
+    for name in sorted(os.listdir(directory) if os.path.isdir(directory) else [], key=lambda name: name.endswith('.npy')):
+        destination = f'{dataDirectory}/{name}'
+        shutil.move(f'{directory}/{name}', destination)
+        paths.append(destination)
+    return paths
+
+
+def runSweep(queue, names, document, command, dataDirectory, stagingDirectory,
+             workers=1, timeout=None, retries=2, heap=None, ingest=True, pollInterval=0.5):
+    """
+    Runs the pending jobs among names, workers at a time, until each one is done or failed retries + 1 times.
+    After each job, its data files are moved to dataDirectory and `process.py ingest` runs in the background,
+    once at a time, covering every file finished meanwhile.
+    On interruption, running jobs are killed and left pending.
+
+    Parameters
+    ----------
+    queue : JobQueue
+        the queue to take the jobs from and record their progress in
+    names : list of str
+        the jobs to run, in order
+    document : dict
+        the simulation file
+    command : list of str
+        the command running a simulation file, which is appended to it
+    dataDirectory : str
+        where to move the data files
+    stagingDirectory : str
+        where the jobs run and export their data
+    workers : int
+        the number of jobs running at once
+    timeout : float, optional
+        seconds after which a job is killed and counted as failed
+    retries : int
+        the attempts after the first one for failed jobs
+    heap : int, optional
+        maximum heap of the JVM of each job, in MB
+    ingest : bool
+        whether to ingest the data files as soon as they are available
+
+    Returns
+    -------
+    list of str
+        The names of the failed jobs
+    """
+    environment = dict(os.environ)
+    if heap is not None:
+        environment['JAVA_OPTS'] = f"{environment.get('JAVA_OPTS', '')} -Xmx{heap}m".strip()
+    pending = collections.deque(name for name in names if queue.jobs[name]['status'] == 'pending')
+    running = {}
+    ingestion = None
+    toIngest = False
+    ingestCommand = [sys.executable, str(Path(__file__).with_name('process.py')), '--data', dataDirectory, 'ingest']
+    print(f'{len(pending)} jobs to run, {workers} at a time')
+    try:
+        while pending or running or ingestion is not None or toIngest:
+            while pending and len(running) < workers:
+                name = pending.popleft()
+                job = queue.jobs[name]
+                running[name] = startJob(name, job, document, command, stagingDirectory, environment)
+                queue.update(name, status='running', attempts=job['attempts'] + 1)
+            for name, job in list(running.items()):
+                seconds = time.monotonic() - job.started
+                code = job.process.poll()
+                if code is None and timeout is not None and seconds > timeout:
+                    stopJob(job)
+                    code = f'timed out after {timeout:.0f}s'
+                if code is None:
+                    continue
+                del running[name]
+                job.log.close()
+                outputs = collectOutputs(job.directory / 'data', dataDirectory) if code == 0 else []
+                if outputs:
+                    queue.update(name, status='done', seconds=seconds, error=None)
+                    shutil.rmtree(job.directory, ignore_errors=True)
+                    toIngest = ingest
+                    print(f'{name} done in {seconds:.0f}s')
+                    continue
+                if code == 0:
+                    error = 'no data files exported'
+                else:
+                    error = f'exit code {code}' if isinstance(code, int) else code
+                attempts = queue.jobs[name]['attempts']
+                if attempts <= retries:
+                    queue.update(name, status='pending', seconds=seconds, error=error)
+                    pending.append(name)
+                    print(f'{name} failed ({error}), retrying')
+                else:
+                    queue.update(name, status='failed', seconds=seconds, error=error)
+                    print(f'{name} failed ({error}) after {attempts} attempts, see {job.directory}/output.log')
+            if ingestion is not None and ingestion.poll() is not None:
+                if ingestion.returncode != 0:
+                    print(f'WARNING: ingestion failed with exit code {ingestion.returncode}')
+                ingestion = None
+            if ingestion is None and toIngest:
+                ingestion = subprocess.Popen(ingestCommand, stdout=subprocess.DEVNULL)
+                toIngest = False
+            time.sleep(pollInterval)
+    except KeyboardInterrupt:
+        for name, job in running.items():
+            stopJob(job)
+            queue.update(name, status='pending', attempts=queue.jobs[name]['attempts'] - 1)
+        if ingestion is not None:
+            ingestion.wait()
+        raise
+    return [name for name in names if queue.jobs[name]['status'] == 'failed']
+
+
+def installedLauncher():
+    """
+    Returns the start script of the simulator installed by `./gradlew installDist`, building it if missing.
+    """
+    def find():
+        scripts = glob.glob('build/install/*/bin/*')
+        return [script for script in scripts if script.endswith('.bat') == (os.name == 'nt')]
+
+    if not find():
+        print('Installing the simulator with gradle')
+        subprocess.run(['gradlew.bat' if os.name == 'nt' else './gradlew', '--quiet', 'installDist'], check=True)
+    return find()[0]
+
+
+def defaultWorkers(heap):
+    """
+    Returns the number of jobs fitting the available cores and 90% of the available memory (on Linux).
+    """
+    cores = os.cpu_count() or 1
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES') / 2 ** 20
+    except (AttributeError, ValueError, OSError):
+        return cores
+    return max(1, min(cores, int(memory * 0.9 // heap)))
+
+
+def matches(value, accepted):
+    """
+    Returns whether a variable value is among the accepted ones, each either a value or a (min, max) range.
+    """
+    parsed = process.FileIndex.parseValue(formatValue(value))
+    for option in accepted:
+        if isinstance(option, tuple):
+            if isinstance(parsed, float) and option[0] <= parsed <= option[1]:
+                return True
+        elif parsed == option:
+            return True
+    return False
+
+
+def printStatus(queue, names):
+    counts = collections.Counter(queue.jobs[name]['status'] for name in names)
+    print(', '.join(f'{counts[status]} {status}' for status in ['done', 'running', 'pending', 'failed']))
+    for name in names:
+        job = queue.jobs[name]
+        if job['status'] == 'failed' or job.get('error') and job['status'] == 'pending':
+            print(f"  {name}: {job['status']} after {job['attempts']} attempts, {job['error']}")
+
+
+if __name__ == '__main__':
+    simulationFile = 'src/main/yaml/dynamicAllocation.yml'
+    directory = 'data'
+    stateDirectory = '.sweep'
+    taskSize = 512
+
+    parser = argparse.ArgumentParser(description='Runs the simulations of a sweep as independent jobs on the local cores.')
+    parser.add_argument('--simulation', default=simulationFile, help='the simulation file, its free variables are swept')
+    parser.add_argument('--data', default=directory, help='where to move the data files')
+    parser.add_argument('--state', default=stateDirectory, help='where to keep the queue and the running jobs')
+    parser.add_argument('--workers', type=int, help='jobs running at once, defaults to those fitting the cores and the memory')
+    parser.add_argument('--heap', type=int, default=taskSize, help='maximum heap of each job, in MB')
+    parser.add_argument('--timeout', type=float, help='seconds after which a job is killed and retried')
+    parser.add_argument('--retries', type=int, default=2, help='attempts after the first one for failed jobs')
+    parser.add_argument('--retry-failed', action='store_true', help='run again the jobs that failed in previous runs')
+    parser.add_argument('--no-ingest', action='store_true', help='do not run process.py on the finished jobs')
+    parser.add_argument(
+        '--launcher',
+        help='the command running a simulation file, which is appended to it (defaults to the script installed by gradle installDist)',
+    )
+    commands = parser.add_subparsers(dest='command')
+    for command, description in [('run', 'run the pending jobs, the default'), ('status', 'count the jobs by status, listing the failed ones')]:
+        commands.add_parser(command, help=description).add_argument(
+            'where', nargs='*', metavar='name=value',
+            help='only the jobs with these values, repeat a name to accept more, and use MIN..MAX for ranges (e.g. Seed=0..9)',
+        )
+    arguments = parser.parse_args()
+    with open(arguments.simulation) as file:
+        document = yaml.safe_load(file)
+    where = collections.defaultdict(list)
+    for condition in getattr(arguments, 'where', []):
+        name, separator, value = condition.partition('=')
+        if not separator:
+            parser.error(f'expected name=value, got {condition}')
+        low, dots, high = value.partition('..')
+        bounds = [process.FileIndex.parseValue(v) for v in (low, high)]
+        where[name].append(tuple(bounds) if dots and all(isinstance(v, float) for v in bounds) else process.FileIndex.parseValue(value))
+    variables = sweepVariables(document)
+    unknown = [name for name in where if name not in variables]
+    if unknown:
+        parser.error(f'unknown variables {", ".join(unknown)}, available: {", ".join(variables)}')
+    selected = {name: [v for v in values if name not in where or matches(v, where[name])] for name, values in variables.items()}
+    queue = JobQueue(f'{arguments.state}/queue.jsonl')
+    names = []
+    for combination in itertools.product(*selected.values()):
+        coordinates = dict(zip(selected, combination))
+        name = jobName(coordinates)
+        queue.add(name, coordinates)
+        names.append(name)
+    if arguments.command == 'status':
+        printStatus(queue, names)
+        sys.exit()
+    for name in names:
+        job = queue.jobs[name]
+        if job['status'] != 'done' and exported(arguments.data, outputNames(document, name)):
+            queue.update(name, status='done', error=None)
+        elif job['status'] == 'failed' and arguments.retry_failed:
+            queue.update(name, status='pending', attempts=0)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    launcher = shlex.split(arguments.launcher) if arguments.launcher else [installedLauncher(), 'run']
+    start = time.perf_counter()
+    try:
+        failed = runSweep(
+            queue, names, document, launcher, arguments.data, f'{arguments.state}/jobs',
+            workers=arguments.workers or defaultWorkers(arguments.heap),
+            timeout=arguments.timeout, retries=arguments.retries, heap=arguments.heap, ingest=not arguments.no_ingest,
+        )
+    except KeyboardInterrupt:
+        print('Interrupted, run again to resume')
+        sys.exit(130)
+    finally:
+        queue.close()
+    print(f'Sweep of {len(names)} jobs over in {time.perf_counter() - start:.0f}s, {len(failed)} failed')
+    if failed:
+        sys.exit(1)
+    if not arguments.no_ingest:
+        subprocess.run([sys.executable, str(Path(__file__).with_name('process.py')), '--data', arguments.data, 'aggregate'], check=True)